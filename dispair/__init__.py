@@ -1,5 +1,6 @@
 import logging
 
+from .asgi import ASGIApplication
 from .webhook_client import WebhookClient
 from .gateway_client import GatewayClient
 from .router import Router
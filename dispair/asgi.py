@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from dispair.webhook_client import WebhookClient
+
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+
+JSON_HEADERS = [(b"content-type", b"application/json")]
+
+
+class ASGIApplication:
+    """
+    ASGI application serving the interaction endpoint of a WebhookClient.
+
+    Requests are processed by `WebhookClient.process`, the same as the aiohttp endpoint.
+    Commands are synced when the server sends the lifespan startup event, unless
+    `sync_commands` is False, and the client is shut down with the server.
+
+    The server runs its own event loop, the client is moved onto it at startup, or by the
+    first request for servers that do not send lifespan events.
+    """
+
+    def __init__(self, client: WebhookClient, *, sync_commands: bool = True):
+        self.client = client
+        self.sync_commands = sync_commands
+        self._logger = logging.getLogger("ASGIApplication")
+
+    async def __call__(self, scope: dict, receive: Receive, send: Send) -> None:  # noQA: D102
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self._bind_client()
+                    if self.sync_commands:
+                        await self.client.sync_commands()
+                except Exception as err:
+                    self._logger.exception("Failed to sync commands")
+                    await send({"type": "lifespan.startup.failed", "message": repr(err)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.client.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _bind_client(self) -> None:
+        """Move the client onto the server's event loop, when it was created on another one."""
+        loop = asyncio.get_running_loop()
+        if self.client._loop is loop:
+            return
+
+        self._logger.debug("Binding the client to the server's event loop")
+        stale = self.client._http_session
+        self.client._bind_loop(loop)
+        await stale.kill()
+
+    async def _http(self, scope: dict, receive: Receive, send: Send) -> None:
+        await self._bind_client()
+        if scope["path"] != self.client.interaction_endpoint:
+            return await self._respond(send, 404)
+        if scope["method"] != "POST":
+            return await self._respond(send, 405)
+
+        headers = dict(scope["headers"])
+        timestamp = headers.get(b"x-signature-timestamp")
+        ed25519 = headers.get(b"x-signature-ed25519")
+        if timestamp is None or ed25519 is None:
+            return await self._respond(send, 401)
+
+        body = await self._read_body(receive)
+        if (reply := await self.client.process(timestamp.decode(), ed25519.decode(), body)) is None:
+            return await self._respond(send, 401)
+
+        body, interaction = reply
+        try:
+            await self._respond(send, 200, body)
+        except Exception:
+            if interaction is not None:
+                self.client._acknowledge(interaction, False)
+            raise
+        if interaction is not None:
+            self.client._acknowledge(interaction)
+
+    @staticmethod
+    async def _read_body(receive: Receive) -> bytes:
+        message = await receive()
+        body = message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+        chunks = [body]
+        while message.get("more_body", False):
+            message = await receive()
+            chunks.append(message.get("body", b""))
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _respond(send: Send, status: int, body: bytes = b"") -> None:
+        await send({"type": "http.response.start", "status": status, "headers": JSON_HEADERS if body else []})
+        await send({"type": "http.response.body", "body": body})
@@ -1,22 +1,29 @@
 import asyncio
 import logging
+import time
 from abc import ABC
 from asyncio import AbstractEventLoop
 from collections import ChainMap, defaultdict
 from dataclasses import dataclass, field
-from typing import Optional, Union
+from typing import Awaitable, Callable, Optional, Union
 
 from aiohttp import ClientResponseError
 
-from dispair.http.http_session import HttpSession, ApiPath
+from dispair.codec import JsonCodec, get_codec
+from dispair.deadline import INITIAL_RESPONSE_WINDOW, INTERACTION_TOKEN_LIFETIME, current_deadline
+from dispair.http.http_session import HttpSession, ApiPath, Priority
 from dispair.models.interaction import Interaction
-from dispair.models.response import Response
+from dispair.models.response import DEFERRED, Response
 from dispair.utils.embed import Embed
+from .dispatch_table import DispatchTable
+from .member_cache import MemberCache
 from .missing_handler import MissingHandler
 from .models import Handler, Option
 from .router import Router
+from .workers import WorkerPool
 
 MISSING_HANDLER = MissingHandler()
+TIMEOUT_RESPONSE = Response("> This command took too long to respond").freeze()
 
 
 @dataclass
@@ -50,13 +57,44 @@ class Client(ABC):
             app_id: str, *,
             missing_handler: MissingHandler = MISSING_HANDLER,
             log_level: int = 20,
-            loop: AbstractEventLoop = None
+            loop: AbstractEventLoop = None,
+            reconcile_concurrency: int = 4,
+            member_cache: Optional[MemberCache] = None,
+            json_codec: Union[str, JsonCodec] = "stdlib",
+            defer_after: Optional[float] = 2.5,
+            timeout_response: Response = TIMEOUT_RESPONSE,
+            http_timeout: float = 30,
+            http_options: Optional[dict] = None,
+            warm_connections: int = 0,
+            shutdown_grace: float = 5
     ):
+        """
+        Create a Client.
+
+        `json_codec` is used for every JSON payload, it is either a JsonCodec or one of
+        `stdlib`, `orjson` or `auto`, which uses orjson when it is installed.
+        Handlers that take longer than `defer_after` seconds are deferred, see `respond`.
+        Handlers that exceed their own timeout or the interaction's deadline are cancelled and
+        `timeout_response` is sent instead.
+        `http_timeout` is the total timeout of requests made to the DiscordAPI, `http_options` are
+        passed on to the HttpSession to configure its connection pool. When `warm_connections` is
+        set, that many connections are opened before the client starts and kept warm while idle.
+        On shutdown, deferred interactions get `shutdown_grace` seconds to finish before they are cancelled.
+        """
         assert app_id is not None, "Missing App ID"
         assert bot_token is not None, "Missing Bot Token"
         self.bot_token = bot_token
         self.app_id = app_id
         self.missing_handler = missing_handler
+        self.member_cache = member_cache
+        self.json_codec = get_codec(json_codec)
+        self.defer_after = defer_after
+        self.timeout_response = timeout_response
+        self.http_timeout = http_timeout
+        self.http_options = http_options or {}
+        self.warm_connections = warm_connections
+        self.shutdown_grace = shutdown_grace
+        self._followups: set[asyncio.Task] = set()
 
         self._global_commands: dict[str, Command] = {}
         self._guild_commands: dict[int, dict[str, Command]] = defaultdict(dict)
@@ -65,12 +103,20 @@ class Client(ABC):
 
         # Because we cannot query what guilds have put the bot into their server for just SlashCommands.
         # The best alternative is to keep a set of guilds we received interactions for, assign handler for etc.
-        # This means we can keep them synced.
+        # This means we can keep them synced. The GatewayClient also learns them from guild events.
         self._known_guilds: set[int] = set()
 
+        # Guild commands are reconciled by background tasks, so interactions never wait on a sync.
+        self.reconcile_concurrency = reconcile_concurrency
+        self._reconcile_queue: Optional[asyncio.Queue[int]] = None
+        self._reconcilers: list[asyncio.Task] = []
+
         self._routers = []
+        self._dispatch_table = DispatchTable.compile(self._routers)
         self._loop = loop or asyncio.get_event_loop()
-        self._http_session = HttpSession(bot_token)
+        self._http_session = HttpSession(
+            bot_token, loop=self._loop, codec=self.json_codec, timeout=http_timeout, **self.http_options
+        )
         self._logger = logging.getLogger("Client")
         self._logger.setLevel(log_level)
 
@@ -85,20 +131,42 @@ class Client(ABC):
         return ChainMap(self._global_commands, self._guild_commands)
 
     async def handle(self, interaction: Interaction) -> Response:
-        """Handle an interaction."""
-        if interaction.guild_id not in self._known_guilds:
-            await self._sync_guild_commands(interaction.guild_id)
-            self._known_guilds.add(interaction.guild_id)
+        """
+        Handle an interaction.
 
-        if guild_handlers := self.handlers.get(interaction.guild_id):
-            handler = guild_handlers.get(interaction.name)
-        else:
-            handler = self.handlers.get(interaction.name)
+        Interactions from a guild that is not known yet are dispatched straight away,
+        the guild's commands are reconciled in the background. The interaction's deadline
+        is available to the handler through `dispair.deadline` while it runs. It is the token's
+        lifetime when the response can be deferred, otherwise Discord's initial response window.
+        """
+        # Interactions from DMs have no guild to reconcile.
+        if interaction.guild_id is not None and interaction.guild_id not in self._known_guilds:
+            self._discover_guild(interaction.guild_id)
+
+        if self.member_cache is not None:
+            interaction.member_cache = self.member_cache
+            if interaction.member:
+                self.member_cache.put(interaction.author)
 
+        handler = self._dispatch_table.get(interaction.guild_id, interaction.name)
         if handler is None:
             handler = self.missing_handler
 
-        response = await handler.handle(interaction)
+        window = INTERACTION_TOKEN_LIFETIME if self.defer_after is not None else INITIAL_RESPONSE_WINDOW
+        interaction.deadline = min(interaction.deadline, interaction.received_at + window)
+        if (timeout := getattr(handler, "timeout", None)) is not None:
+            interaction.deadline = min(interaction.deadline, time.monotonic() + timeout)
+
+        # Every handler is cancelled at the deadline, its response could no longer be delivered.
+        token = current_deadline.set(interaction.deadline)
+        try:
+            response = await asyncio.wait_for(handler.handle(interaction), max(interaction.remaining, 0))
+        except asyncio.TimeoutError:
+            self._logger.warning(f"Handler for interaction {interaction.name} did not finish before its deadline")
+            return self.timeout_response
+        finally:
+            current_deadline.reset(token)
+
         if isinstance(response, Response):
             return response
         elif isinstance(response, (int, str)):
@@ -111,9 +179,79 @@ class Client(ABC):
             except ValueError:
                 raise ValueError(f"Cannot send type {response} as a Interaction response.")
 
+    async def respond(self, interaction: Interaction) -> Response:
+        """
+        Handle an interaction within the defer budget.
+
+        Discord only waits 3 seconds for the response to an interaction. If the handler has not
+        finished after `defer_after` seconds, a deferred response is returned to acknowledge the
+        interaction and the handler's response is sent once it is done, by editing the original response.
+        The edit waits until the transport has delivered the deferred response, see `_acknowledge`.
+        """
+        task = asyncio.ensure_future(self.handle(interaction))
+        if self.defer_after is None:
+            return await task
+
+        done, _ = await asyncio.wait((task,), timeout=self.defer_after)
+        if done:
+            return task.result()
+
+        self._logger.debug(f"Deferring interaction {interaction.name}, it exceeded {self.defer_after}s")
+        interaction.acknowledged = asyncio.get_running_loop().create_future()
+        followup = asyncio.create_task(self._follow_up(interaction, task))
+        self._followups.add(followup)
+        followup.add_done_callback(self._followups.discard)
+        return DEFERRED
+
+    async def _follow_up(self, interaction: Interaction, task: asyncio.Future) -> None:
+        """Send the response of a deferred interaction by editing its original response."""
+        try:
+            response = await task
+        except Exception:
+            self._logger.exception(f"Handler for deferred interaction {interaction.name} raised an exception")
+            return
+        if interaction.remaining <= 0:
+            self._logger.warning(f"Dropping the response to interaction {interaction.name}, its deadline has passed")
+            return
+
+        # The original response can only be edited once Discord has the deferred response.
+        try:
+            delivered = await asyncio.wait_for(asyncio.shield(interaction.acknowledged), max(interaction.remaining, 0))
+        except asyncio.TimeoutError:
+            delivered = False
+        if not delivered:
+            self._logger.warning(f"Deferred response for interaction {interaction.name} was not delivered")
+            return
+
+        try:
+            await self._http_session.request(
+                "PATCH",
+                ApiPath(
+                    "/webhooks/{app_id}/{interaction_token}/messages/@original",
+                    app_id=self.app_id,
+                    interaction_token=interaction.token,
+                ),
+                json=response.message(),
+                priority=Priority.INTERACTION
+            )
+        except Exception:
+            self._logger.exception(f"Failed to send the deferred response for interaction {interaction.name}")
+
+    @staticmethod
+    def _acknowledge(interaction: Interaction, delivered: bool = True) -> None:
+        """Record if the response to an interaction was delivered, releasing the follow-up of a deferred one."""
+        if (acknowledged := interaction.acknowledged) is not None and not acknowledged.done():
+            acknowledged.set_result(delivered)
+
     def attach_router(self, router: Router) -> None:
-        """Attach a router to the Client."""
+        """
+        Attach a router to the Client.
+
+        The dispatch table is recompiled and swapped in as a whole, so a router can be
+        attached while interactions are being handled.
+        """
         self._routers.append(router)
+        self._dispatch_table = DispatchTable.compile(self._routers)
         for name, handler in router.handlers.items():
             if handler.is_global:
                 self._global_handlers[name] = handler
@@ -148,10 +286,44 @@ class Client(ABC):
         guild_commands = await self._fetch_guild_commands(guild)
 
         for command in guild_commands.values():
-            if command.name not in self.handlers[guild]:
+            if command.name not in self._guild_handlers.get(guild, {}):
                 self._logger.debug(f"Unregistering unhandled command: {command.name}")
                 await self._unregister_command(command, guild)
 
+    def _discover_guild(self, guild: int) -> None:
+        """Add a guild to the known guilds, queueing it to be reconciled if it is new."""
+        if guild in self._known_guilds:
+            return
+
+        self._known_guilds.add(guild)
+        if self._reconcile_queue is None:
+            self._start_reconcilers()
+        self._reconcile_queue.put_nowait(guild)
+
+    def _forget_guild(self, guild: int) -> None:
+        """Remove a guild the bot is no longer a member of."""
+        self._known_guilds.discard(guild)
+        self._guild_commands.pop(guild, None)
+
+    def _start_reconcilers(self) -> None:
+        self._reconcile_queue = asyncio.Queue()
+        self._reconcilers = [
+            asyncio.create_task(self._reconcile_loop()) for _ in range(self.reconcile_concurrency)
+        ]
+
+    async def _reconcile_loop(self) -> None:
+        """Sync the commands of discovered guilds, one guild at a time."""
+        while True:
+            guild = await self._reconcile_queue.get()
+            try:
+                # The guild may have been forgotten while it was queued.
+                if guild in self._known_guilds:
+                    await self._sync_guild_commands(guild)
+            except Exception:
+                self._logger.exception(f"Failed to sync guild commands for guild: {guild}")
+            finally:
+                self._reconcile_queue.task_done()
+
     async def _sync_all_guild_commands(self) -> None:
         for guild in self._known_guilds:
             await self._sync_guild_commands(guild)
@@ -168,13 +340,15 @@ class Client(ABC):
             await self._http_session.request(
                 "POST",
                 ApiPath("applications/{app_id}/guilds/{guild_id}/commands", app_id=self.app_id, guild_id=guild),
-                json=handler.json
+                json=handler.json,
+                priority=Priority.BACKGROUND
             )
         else:
             await self._http_session.request(
                 "POST",
                 ApiPath("applications/{app_id}/commands", app_id=self.app_id),
-                json=handler.json
+                json=handler.json,
+                priority=Priority.BACKGROUND
             )
 
     async def _unregister_command(self, command: Command, guild: Optional[int] = None) -> None:
@@ -194,11 +368,13 @@ class Client(ABC):
                     guild_id=guild,
                     command_id=command.id
                 ),
+                priority=Priority.BACKGROUND
             )
         else:
             await self._http_session.request(
                 "DELETE",
                 ApiPath("applications/{app_id}/commands/{command_id}", app_id=self.app_id, command_id=command.id),
+                priority=Priority.BACKGROUND
             )
 
     async def _fetch_all_global_commands(self) -> dict[str, Command]:
@@ -206,6 +382,7 @@ class Client(ABC):
         resp = await self._http_session.request(
             "GET",
             ApiPath("/applications/{app_id}/commands", app_id=self.app_id),
+            priority=Priority.BACKGROUND
         )
         for command in [Command(**data) for data in resp]:
             self._global_commands[command.name] = command
@@ -216,6 +393,7 @@ class Client(ABC):
         resp = await self._http_session.request(
             "GET",
             ApiPath("/applications/{app_id}/guilds/{guild_id}/commands", app_id=self.app_id, guild_id=guild),
+            priority=Priority.BACKGROUND
         )
         for command in [Command(**data) for data in resp]:
             self._guild_commands[guild][command.name] = command
@@ -228,33 +406,84 @@ class Client(ABC):
 
         return self._guild_commands
 
+    async def sync_commands(self) -> None:
+        """Register the handlers of every attached router with the DiscordAPI and remove unhandled commands."""
+        await self._fetch_all_global_commands()
+        await self._fetch_all_guild_commands()
+
+        for router in self._routers:
+            for handler in router.handlers.values():
+                self._logger.debug(f"Ensuring that {handler.name} command is assigned.")
+                await self._ensure_handler_registered(handler)
+
+        await self._sync_global_commands()
+        await self._sync_all_guild_commands()
+
     def run(self) -> None:
         """
         Begin running the bot.
 
         This base class will register all attached routers/handlers with the DiscordAPI.
         It will then Remove any unregistered handlers. This will block until the client is stopped.
+        The connection pool is warmed first, when `warm_connections` is set.
         """
-        loop = asyncio.get_event_loop()
-
-        # Startup requests
-        loop.run_until_complete(self._fetch_all_global_commands())
-        loop.run_until_complete(self._fetch_all_guild_commands())
-
-        for router in self._routers:
-            for handler in router.handlers.values():
-                self._logger.debug(f"Ensuring that {handler.name} command is assigned.")
-                try:
-                    loop.run_until_complete(self._ensure_handler_registered(handler))
-                except ClientResponseError as err:
-                    self._logger.error(f"Received HTTPError {err.status} while trying to assign handlers. Exiting...")
-                    loop.run_until_complete(self.shutdown())
-                    exit(-1)
+        loop = self._loop
+        if self.warm_connections:
+            loop.run_until_complete(self._http_session.warm(self.warm_connections))
+            self._http_session.keep_warm(self.warm_connections)
+
+        try:
+            loop.run_until_complete(self.sync_commands())
+        except ClientResponseError as err:
+            self._logger.error(f"Received HTTPError {err.status} while syncing commands. Exiting...")
+            loop.run_until_complete(self.shutdown())
+            exit(-1)
+
+    def _run_workers(self, workers: int, serve: Callable[[int], Awaitable[None]]) -> None:
+        """
+        Run `serve` in `workers` forked processes, blocking until every worker has stopped.
 
-        loop.run_until_complete(self._sync_global_commands())
-        loop.run_until_complete(self._sync_all_guild_commands())
+        Each worker opens its own HttpSession, the connections of this one must not be shared.
+        `serve` is called with the index of the worker, on the worker's own event loop.
+        """
+        self._loop.run_until_complete(self._http_session.kill())
+        WorkerPool(lambda index: self._run_worker(serve, index), workers).run()
+
+    def _run_worker(self, serve: Callable[[int], Awaitable[None]], index: int) -> None:
+        """Entry point of a worker process."""
+        self._prepare_worker()
+        try:
+            self._loop.run_until_complete(serve(index))
+        except KeyboardInterrupt:
+            pass
+
+    def _prepare_worker(self) -> None:
+        """Replace the event loop and HttpSession inherited from the parent of a worker process."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._bind_loop(loop)
+
+    def _bind_loop(self, loop: AbstractEventLoop) -> None:
+        """Replace the HttpSession and background tasks with ones that run on `loop`."""
+        self._loop = loop
+        self._http_session = HttpSession(
+            self.bot_token, loop=self._loop, codec=self.json_codec, timeout=self.http_timeout, **self.http_options
+        )
+        if self.warm_connections:
+            self._http_session.keep_warm(self.warm_connections)
+        self._reconcile_queue = None
+        self._reconcilers = []
 
     async def shutdown(self) -> None:
         """Shutdown the bot, closing any resources being currently used."""
         self._logger.info("Client shutting down.")
+        for task in self._reconcilers:
+            task.cancel()
+        if self._followups:
+            self._logger.debug(f"Waiting up to {self.shutdown_grace}s on {len(self._followups)} deferred interactions")
+            _, pending = await asyncio.wait(set(self._followups), timeout=self.shutdown_grace)
+            # Cancelling a follow-up also cancels the handler task it is waiting on.
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
         await self._http_session.kill()
@@ -0,0 +1,66 @@
+"""
+JSON codecs used for every payload sent to and received from Discord.
+
+Codecs encode to bytes and decode from bytes or str, so payloads never take a
+round trip through str. The orjson codec is only available when orjson is installed.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JsonCodec:
+    """Encode and decode JSON using the standard library."""
+
+    name = "stdlib"
+
+    def dumps(self, obj: Any) -> bytes:
+        """Encode an object as JSON."""
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """Decode a JSON document."""
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """Encode and decode JSON using orjson."""
+
+    name = "orjson"
+
+    def __init__(self):
+        assert orjson is not None, "The orjson codec requires orjson to be installed"
+
+    def dumps(self, obj: Any) -> bytes:
+        """Encode an object as JSON."""
+        return orjson.dumps(obj)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """Decode a JSON document."""
+        return orjson.loads(data)
+
+
+STDLIB = JsonCodec()
+
+
+def get_codec(codec: Union[str, JsonCodec] = "stdlib") -> JsonCodec:
+    """
+    Get a JSON codec by name.
+
+    `auto` uses orjson when it is installed and the standard library otherwise.
+    A JsonCodec instance is returned as is.
+    """
+    if isinstance(codec, JsonCodec):
+        return codec
+    if codec == "stdlib":
+        return STDLIB
+    if codec == "orjson" or (codec == "auto" and orjson is not None):
+        return OrjsonCodec()
+    if codec == "auto":
+        return STDLIB
+    raise ValueError(f"Unknown JSON codec: {codec}")
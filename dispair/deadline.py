@@ -0,0 +1,25 @@
+"""
+Deadline of the interaction currently being handled.
+
+The Client sets the deadline before calling a handler, so the handler and any
+requests it makes through the HttpSession can stop once the response could no
+longer be delivered. Times are from `time.monotonic`.
+"""
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Seconds that an interaction token can be used to respond for.
+INTERACTION_TOKEN_LIFETIME = 15 * 60
+# Seconds that Discord waits for the initial response to an interaction.
+INITIAL_RESPONSE_WINDOW = 3
+
+current_deadline: ContextVar[Optional[float]] = ContextVar("dispair_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Get the seconds left until the current interaction's deadline, None outside of an interaction."""
+    if (deadline := current_deadline.get()) is None:
+        return None
+    return deadline - time.monotonic()
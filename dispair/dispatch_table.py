@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from dispair.models.handler import Handler
+from dispair.router import Router
+
+
+class DispatchTable:
+    """
+    Precompiled lookup of the handler for an interaction.
+
+    Each guild's mapping already contains the global handlers, with guild handlers taking
+    priority, so finding a handler never has to fall back between maps or allocate.
+    A table is never modified after it is compiled, a new one is compiled instead.
+    """
+
+    __slots__ = ("_global", "_guilds")
+
+    def __init__(self, global_handlers: dict[str, Handler], guild_handlers: dict[int, dict[str, Handler]]):
+        self._global = global_handlers
+        self._guilds = guild_handlers
+
+    @classmethod
+    def compile(cls, routers: Iterable[Router]) -> DispatchTable:
+        """Compile the handlers of the routers into a DispatchTable, later routers take priority."""
+        global_handlers: dict[str, Handler] = {}
+        guild_handlers: dict[int, dict[str, Handler]] = defaultdict(dict)
+
+        for router in routers:
+            for name, handler in router.handlers.items():
+                if handler.is_global:
+                    global_handlers[name] = handler
+                for guild in handler.guilds:
+                    guild_handlers[guild][name] = handler
+
+        return cls(
+            global_handlers,
+            {guild: {**global_handlers, **handlers} for guild, handlers in guild_handlers.items()}
+        )
+
+    def get(self, guild_id: Optional[int], name: str) -> Optional[Handler]:
+        """Get the handler for a command used in a guild, None if there is no handler."""
+        return self._guilds.get(guild_id, self._global).get(name)
+
+    def __len__(self) -> int:
+        return len(self._global) + sum(len(handlers) for handlers in self._guilds.values())
@@ -1,2 +1,15 @@
 class HandlerNotDefined(Exception):
     ...
+
+
+class ETFDecodeError(ValueError):
+    """Raised when data is not a valid External Term Format term."""
+
+
+class MissingOptions(Exception):
+    """Raised when an interaction is missing options that are required by its handler."""
+
+    def __init__(self, handler: str, options: list[str]):
+        super().__init__(f"Interaction for {handler} is missing required options: {', '.join(options)}")
+        self.handler = handler
+        self.options = options
@@ -0,0 +1,3 @@
+from . import etf
+from .shard import Shard
+from .shard_manager import ShardManager
@@ -0,0 +1,31 @@
+import zlib
+from typing import Optional
+
+# Every complete zlib-stream message ends with the Z_SYNC_FLUSH marker.
+ZLIB_SUFFIX = b"\x00\x00\xff\xff"
+
+
+class ZlibStreamDecompressor:
+    """
+    Decompressor for a Gateway connection using `compress=zlib-stream`.
+
+    The whole connection shares one zlib context, so a new decompressor
+    must be used for every connection.
+    """
+
+    def __init__(self):
+        self._inflator = zlib.decompressobj()
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> Optional[bytes]:
+        """Feed a websocket frame, returning the decompressed payload once a message is complete."""
+        if data[-4:] != ZLIB_SUFFIX:
+            self._buffer.extend(data)
+            return None
+
+        if self._buffer:
+            self._buffer.extend(data)
+            data = bytes(self._buffer)
+            self._buffer.clear()
+
+        return self._inflator.decompress(data)
@@ -0,0 +1,323 @@
+"""
+Erlang External Term Format encoding for the DiscordAPI Gateway.
+
+https://www.erlang.org/doc/apps/erts/erl_ext_dist.html
+
+Terms are decoded into the same shapes the Gateway sends as JSON: atoms become
+strings (or None/True/False), binaries become strings and maps become dicts.
+"""
+
+import struct
+import zlib
+from typing import Any, Callable
+
+from dispair.exceptions import ETFDecodeError
+
+VERSION = 131
+
+NEW_FLOAT_EXT = 70
+COMPRESSED = 80
+SMALL_INTEGER_EXT = 97
+INTEGER_EXT = 98
+FLOAT_EXT = 99
+ATOM_EXT = 100
+SMALL_TUPLE_EXT = 104
+LARGE_TUPLE_EXT = 105
+NIL_EXT = 106
+STRING_EXT = 107
+LIST_EXT = 108
+BINARY_EXT = 109
+SMALL_BIG_EXT = 110
+LARGE_BIG_EXT = 111
+SMALL_ATOM_EXT = 115
+MAP_EXT = 116
+ATOM_UTF8_EXT = 118
+SMALL_ATOM_UTF8_EXT = 119
+
+_ATOMS = {"nil": None, "true": True, "false": False}
+
+_unpack_uint16 = struct.Struct(">H").unpack_from
+_unpack_uint32 = struct.Struct(">I").unpack_from
+_unpack_int32 = struct.Struct(">i").unpack_from
+_unpack_double = struct.Struct(">d").unpack_from
+_pack_uint32 = struct.Struct(">I").pack
+_pack_int32 = struct.Struct(">i").pack
+_pack_double = struct.Struct(">d").pack
+
+
+def _atom(name: str) -> Any:
+    return _ATOMS.get(name, name)
+
+
+def _decode_small_integer(data: bytes, pos: int) -> tuple[int, int]:
+    return data[pos], pos + 1
+
+
+def _decode_integer(data: bytes, pos: int) -> tuple[int, int]:
+    return _unpack_int32(data, pos)[0], pos + 4
+
+
+def _decode_new_float(data: bytes, pos: int) -> tuple[float, int]:
+    return _unpack_double(data, pos)[0], pos + 8
+
+
+def _decode_float(data: bytes, pos: int) -> tuple[float, int]:
+    return float(data[pos:pos + 31].rstrip(b"\x00")), pos + 31
+
+
+def _decode_atom(data: bytes, pos: int) -> tuple[Any, int]:
+    length = _unpack_uint16(data, pos)[0]
+    pos += 2
+    return _atom(data[pos:pos + length].decode("utf-8")), pos + length
+
+
+def _decode_small_atom(data: bytes, pos: int) -> tuple[Any, int]:
+    length = data[pos]
+    pos += 1
+    return _atom(data[pos:pos + length].decode("utf-8")), pos + length
+
+
+def _decode_items(data: bytes, pos: int, count: int) -> tuple[list, int]:
+    items = []
+    append = items.append
+    for _ in range(count):
+        tag = data[pos]
+        try:
+            decoder = _DECODERS[tag]
+        except KeyError:
+            raise ETFDecodeError(f"Unknown term tag: {tag}") from None
+        value, pos = decoder(data, pos + 1)
+        append(value)
+    return items, pos
+
+
+def _decode_small_tuple(data: bytes, pos: int) -> tuple[tuple, int]:
+    items, pos = _decode_items(data, pos + 1, data[pos])
+    return tuple(items), pos
+
+
+def _decode_large_tuple(data: bytes, pos: int) -> tuple[tuple, int]:
+    items, pos = _decode_items(data, pos + 4, _unpack_uint32(data, pos)[0])
+    return tuple(items), pos
+
+
+def _decode_nil(data: bytes, pos: int) -> tuple[list, int]:
+    return [], pos
+
+
+def _decode_string(data: bytes, pos: int) -> tuple[list[int], int]:
+    # Erlang sends lists of small integers as a STRING_EXT, they are still lists.
+    length = _unpack_uint16(data, pos)[0]
+    pos += 2
+    return list(data[pos:pos + length]), pos + length
+
+
+def _decode_list(data: bytes, pos: int) -> tuple[list, int]:
+    items, pos = _decode_items(data, pos + 4, _unpack_uint32(data, pos)[0])
+    if data[pos] == NIL_EXT:
+        return items, pos + 1
+
+    # Improper list, keep the tail as the last element.
+    tail, pos = _decode_items(data, pos, 1)
+    items.extend(tail)
+    return items, pos
+
+
+def _decode_binary(data: bytes, pos: int) -> tuple[str, int]:
+    length = _unpack_uint32(data, pos)[0]
+    pos += 4
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+def _decode_big(data: bytes, pos: int, length: int) -> tuple[int, int]:
+    sign = data[pos]
+    pos += 1
+    value = int.from_bytes(data[pos:pos + length], "little")
+    return -value if sign else value, pos + length
+
+
+def _decode_small_big(data: bytes, pos: int) -> tuple[int, int]:
+    return _decode_big(data, pos + 1, data[pos])
+
+
+def _decode_large_big(data: bytes, pos: int) -> tuple[int, int]:
+    return _decode_big(data, pos + 4, _unpack_uint32(data, pos)[0])
+
+
+def _decode_map(data: bytes, pos: int) -> tuple[dict, int]:
+    items, pos = _decode_items(data, pos + 4, _unpack_uint32(data, pos)[0] * 2)
+    return dict(zip(items[::2], items[1::2])), pos
+
+
+def _decode_compressed(data: bytes, pos: int) -> tuple[Any, int]:
+    size = _unpack_uint32(data, pos)[0]
+    term = zlib.decompress(data[pos + 4:])
+    if len(term) != size:
+        raise ETFDecodeError("Compressed term does not match its uncompressed size")
+    value, _ = _decode_items(term, 0, 1)
+    return value[0], len(data)
+
+
+_DECODERS: dict[int, Callable[[bytes, int], tuple[Any, int]]] = {
+    NEW_FLOAT_EXT: _decode_new_float,
+    COMPRESSED: _decode_compressed,
+    SMALL_INTEGER_EXT: _decode_small_integer,
+    INTEGER_EXT: _decode_integer,
+    FLOAT_EXT: _decode_float,
+    ATOM_EXT: _decode_atom,
+    SMALL_TUPLE_EXT: _decode_small_tuple,
+    LARGE_TUPLE_EXT: _decode_large_tuple,
+    NIL_EXT: _decode_nil,
+    STRING_EXT: _decode_string,
+    LIST_EXT: _decode_list,
+    BINARY_EXT: _decode_binary,
+    SMALL_BIG_EXT: _decode_small_big,
+    LARGE_BIG_EXT: _decode_large_big,
+    SMALL_ATOM_EXT: _decode_small_atom,
+    MAP_EXT: _decode_map,
+    ATOM_UTF8_EXT: _decode_atom,
+    SMALL_ATOM_UTF8_EXT: _decode_small_atom,
+}
+
+
+def decode(data: bytes) -> Any:
+    """Decode an External Term Format term."""
+    if not data or data[0] != VERSION:
+        raise ETFDecodeError("Data does not begin with the External Term Format version")
+
+    try:
+        items, pos = _decode_items(data, 1, 1)
+    except (IndexError, struct.error, UnicodeDecodeError, zlib.error) as err:
+        raise ETFDecodeError(f"Malformed term: {err}") from err
+
+    if pos != len(data):
+        raise ETFDecodeError(f"Unexpected trailing data after position {pos}")
+    return items[0]
+
+
+def _skip(data: bytes, pos: int) -> int:
+    """Get the position after the term at `pos` without decoding it."""
+    tag = data[pos]
+    pos += 1
+    if tag == SMALL_INTEGER_EXT:
+        return pos + 1
+    if tag == INTEGER_EXT:
+        return pos + 4
+    if tag == NEW_FLOAT_EXT:
+        return pos + 8
+    if tag == FLOAT_EXT:
+        return pos + 31
+    if tag in (ATOM_EXT, ATOM_UTF8_EXT, STRING_EXT):
+        return pos + 2 + _unpack_uint16(data, pos)[0]
+    if tag in (SMALL_ATOM_EXT, SMALL_ATOM_UTF8_EXT):
+        return pos + 1 + data[pos]
+    if tag == BINARY_EXT:
+        return pos + 4 + _unpack_uint32(data, pos)[0]
+    if tag == SMALL_BIG_EXT:
+        return pos + 2 + data[pos]
+    if tag == LARGE_BIG_EXT:
+        return pos + 5 + _unpack_uint32(data, pos)[0]
+    if tag == NIL_EXT:
+        return pos
+
+    if tag == SMALL_TUPLE_EXT:
+        count, pos = data[pos], pos + 1
+    elif tag == LARGE_TUPLE_EXT:
+        count, pos = _unpack_uint32(data, pos)[0], pos + 4
+    elif tag == LIST_EXT:
+        # The list elements are followed by its tail.
+        count, pos = _unpack_uint32(data, pos)[0] + 1, pos + 4
+    elif tag == MAP_EXT:
+        count, pos = _unpack_uint32(data, pos)[0] * 2, pos + 4
+    else:
+        raise ETFDecodeError(f"Cannot skip term tag: {tag}")
+
+    for _ in range(count):
+        pos = _skip(data, pos)
+    return pos
+
+
+def decode_header(data: bytes, skip: str = "d") -> dict:
+    """
+    Decode a top level map without decoding the value of the `skip` key.
+
+    This lets a Gateway payload's op, event name and sequence be read cheaply,
+    without paying to decode an event that is going to be ignored.
+    """
+    if len(data) < 6 or data[0] != VERSION or data[1] != MAP_EXT:
+        raise ETFDecodeError("Data is not an External Term Format map")
+
+    try:
+        header = {}
+        pos = 6
+        for _ in range(_unpack_uint32(data, 2)[0]):
+            (key,), pos = _decode_items(data, pos, 1)
+            if key == skip:
+                pos = _skip(data, pos)
+            else:
+                (header[key],), pos = _decode_items(data, pos, 1)
+    except (IndexError, struct.error, UnicodeDecodeError) as err:
+        raise ETFDecodeError(f"Malformed term: {err}") from err
+    return header
+
+
+def _encode_atom(name: str, buffer: bytearray) -> None:
+    encoded = name.encode("utf-8")
+    buffer.append(SMALL_ATOM_UTF8_EXT)
+    buffer.append(len(encoded))
+    buffer += encoded
+
+
+def _encode(obj: Any, buffer: bytearray) -> None:
+    if obj is None:
+        _encode_atom("nil", buffer)
+    elif obj is True:
+        _encode_atom("true", buffer)
+    elif obj is False:
+        _encode_atom("false", buffer)
+    elif isinstance(obj, int):
+        if 0 <= obj <= 255:
+            buffer.append(SMALL_INTEGER_EXT)
+            buffer.append(obj)
+        elif -2 ** 31 <= obj < 2 ** 31:
+            buffer.append(INTEGER_EXT)
+            buffer += _pack_int32(obj)
+        else:
+            magnitude = abs(obj)
+            digits = magnitude.to_bytes((magnitude.bit_length() + 7) // 8, "little")
+            if len(digits) > 255:
+                raise ValueError("Integer is too large to encode")
+            buffer.append(SMALL_BIG_EXT)
+            buffer.append(len(digits))
+            buffer.append(1 if obj < 0 else 0)
+            buffer += digits
+    elif isinstance(obj, float):
+        buffer.append(NEW_FLOAT_EXT)
+        buffer += _pack_double(obj)
+    elif isinstance(obj, (str, bytes)):
+        encoded = obj.encode("utf-8") if isinstance(obj, str) else obj
+        buffer.append(BINARY_EXT)
+        buffer += _pack_uint32(len(encoded))
+        buffer += encoded
+    elif isinstance(obj, dict):
+        buffer.append(MAP_EXT)
+        buffer += _pack_uint32(len(obj))
+        for key, value in obj.items():
+            _encode(key, buffer)
+            _encode(value, buffer)
+    elif isinstance(obj, (list, tuple)):
+        if obj:
+            buffer.append(LIST_EXT)
+            buffer += _pack_uint32(len(obj))
+            for item in obj:
+                _encode(item, buffer)
+        buffer.append(NIL_EXT)
+    else:
+        raise TypeError(f"Cannot encode type {type(obj).__name__} as an External Term Format term")
+
+
+def encode(obj: Any) -> bytes:
+    """Encode an object as an External Term Format term."""
+    buffer = bytearray((VERSION,))
+    _encode(obj, buffer)
+    return bytes(buffer)
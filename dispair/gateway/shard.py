@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import platform
+import random
+import re
+import time
+from collections import deque
+from typing import Literal, Optional, TYPE_CHECKING
+
+from aiohttp import ClientError, ClientWebSocketResponse, WSMessage, WSMsgType
+
+from dispair.constants import API_VERSION
+from dispair.models import Interaction
+from . import etf
+from .compression import ZlibStreamDecompressor
+
+if TYPE_CHECKING:
+    from dispair.gateway_client import GatewayClient
+
+# Close codes that mean reconnecting would only fail again, such as an invalid token or intents.
+FATAL_CLOSE_CODES = frozenset((4004, 4010, 4011, 4012, 4013, 4014))
+# Close codes after which the session cannot be resumed and a new IDENTIFY is required.
+INVALID_SESSION_CLOSE_CODES = frozenset((4007, 4009))
+
+# Discord sends the event name and sequence first, so a dispatch can be filtered before it is decoded.
+# Payloads that do not match are always decoded.
+JSON_HEADER = re.compile(r'\{\s*"t"\s*:\s*"([A-Z_]+)"\s*,\s*"s"\s*:\s*(\d+)\s*,')
+JSON_HEADER_BYTES = re.compile(JSON_HEADER.pattern.encode())
+
+
+class Shard:
+    """
+    A single connection to the DiscordAPI Gateway.
+
+    The shard owns the websocket, heartbeat and session state for its connection,
+    interactions it receives are handed to the GatewayClient to be dispatched.
+    """
+
+    def __init__(self, client: GatewayClient, shard_id: int, shard_count: int, *,
+                 latency_window: int = 10, max_backoff: float = 60, compress: bool = False,
+                 encoding: Literal["json", "etf"] = "json"):
+        assert encoding in ("json", "etf"), f"Unsupported Gateway encoding: {encoding}"
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.max_backoff = max_backoff
+        self.compress = compress
+        self.encoding = encoding
+        self._client = client
+        self._ws_session: Optional[ClientWebSocketResponse] = None
+        self._decompressor: Optional[ZlibStreamDecompressor] = None
+
+        self.heartbeat_interval_ms: Optional[int] = None
+        self._sequence: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._heartbeat_acked = True
+        self._heartbeat_sent_at = 0.0
+        self._latencies: deque[float] = deque(maxlen=latency_window)
+
+        self.session_id: Optional[str] = None
+        self.resume_gateway_url: Optional[str] = None
+        self._ready = False
+
+        self._logger = logging.getLogger(f"Shard-{shard_id}")
+        self._logger.setLevel(client._logger.level)
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.shard_id}/{self.shard_count}>"
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Get the average heartbeat round trip time, in seconds, over the latency window."""
+        if not self._latencies:
+            return None
+        return sum(self._latencies) / len(self._latencies)
+
+    @property
+    def latencies(self) -> tuple[float, ...]:
+        """Get the most recent heartbeat round trip times, in seconds, oldest first."""
+        return tuple(self._latencies)
+
+    @property
+    def can_resume(self) -> bool:
+        """Get if the current session can be resumed."""
+        return self.session_id is not None and self._sequence is not None
+
+    def _decode(self, msg: WSMessage) -> Optional[dict]:
+        """Decode a websocket message, returning None while a compressed message is incomplete."""
+        data = msg.data
+        if msg.type == WSMsgType.BINARY and self._decompressor is not None:
+            data = self._decompressor.feed(data)
+            if data is None:
+                return None
+
+        if self.encoding == "etf":
+            header = etf.decode_header(data)
+            if self._skip_event(header.get("t"), header.get("s")):
+                return None
+            return etf.decode(data)
+
+        if isinstance(data, str):
+            match = JSON_HEADER.match(data)
+            if match and self._skip_event(match[1], int(match[2])):
+                return None
+        elif match := JSON_HEADER_BYTES.match(data):
+            if self._skip_event(match[1].decode(), int(match[2])):
+                return None
+        return self._client.json_codec.loads(data)
+
+    def _skip_event(self, event: Optional[str], sequence: Optional[int]) -> bool:
+        """Check if a dispatch is filtered out, keeping its sequence so the session can still be resumed."""
+        if event is None or event in self._client.events:
+            return False
+        self._sequence = sequence
+        return True
+
+    async def _send(self, payload: dict) -> None:
+        """Send a payload to the Gateway using the connection's encoding."""
+        if self.encoding == "etf":
+            await self._ws_session.send_bytes(etf.encode(payload))
+        else:
+            await self._ws_session.send_str(self._client.json_codec.dumps(payload).decode())
+
+    async def _perform_handshake(self) -> None:
+        self._logger.debug("Awaiting first message")
+        payload = None
+        while payload is None:
+            msg = await self._ws_session.receive()
+            if msg.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                raise ConnectionError(f"Gateway closed before the handshake: {msg.type}")
+            payload = self._decode(msg)
+        self._logger.debug("Received first message")
+        if payload.get("op") != 10:
+            raise ConnectionError(f"Gateway did not respond with a handshake: op {payload.get('op')}")
+        self.heartbeat_interval_ms = payload["d"]["heartbeat_interval"]
+
+    async def _identify(self) -> None:
+        await self._client._wait_to_identify(self.shard_id)
+
+        self._logger.debug("Identifying through Gateway")
+        await self._send({
+            "op": 2,
+            "d": {
+                "token": self._client.bot_token,
+                "intents": int(self._client.intents),
+                "shard": [self.shard_id, self.shard_count],
+                "properties": {
+                    "$os": platform.system(),
+                    "$browser": "Dispair",
+                    "$device": "Dispair"
+                }
+            }
+        })
+
+    async def _resume(self) -> None:
+        self._logger.debug(f"Resuming session {self.session_id} from sequence {self._sequence}")
+        await self._send({
+            "op": 6,
+            "d": {
+                "token": self._client.bot_token,
+                "session_id": self.session_id,
+                "seq": self._sequence,
+            }
+        })
+
+    def _invalidate_session(self) -> None:
+        """Forget the current session, the next connection will IDENTIFY instead of RESUME."""
+        self.session_id = None
+        self.resume_gateway_url = None
+        self._sequence = None
+
+    async def _send_heartbeat(self) -> None:
+        self._logger.debug(f"Sending heartbeat with sequence {self._sequence}")
+        self._heartbeat_acked = False
+        self._heartbeat_sent_at = time.perf_counter()
+        await self._send({"op": 1, "d": self._sequence})
+
+    async def _heartbeat_loop(self) -> None:
+        """
+        Send a heartbeat every heartbeat interval, for as long as the websocket is open.
+
+        The first heartbeat is jittered as requested by Discord. If the previous heartbeat
+        was never acknowledged the connection is a zombie, so it is closed to force a reconnect.
+        """
+        interval = self.heartbeat_interval_ms / 1_000
+        await asyncio.sleep(interval * random.random())
+
+        while not self._ws_session.closed:
+            if not self._heartbeat_acked:
+                self._logger.warning("Heartbeat was not acknowledged, reconnecting")
+                # Shielded as the handle loop cancels this task once it sees the websocket closing.
+                await asyncio.shield(self._ws_session.close(code=4000))
+                return
+
+            await self._send_heartbeat()
+            await asyncio.sleep(interval)
+
+    def _heartbeat_ack(self) -> None:
+        self._heartbeat_acked = True
+        self._latencies.append(time.perf_counter() - self._heartbeat_sent_at)
+        self._logger.debug(f"Heartbeat acknowledged, latency {self._latencies[-1] * 1_000:.0f}ms")
+
+    async def handle_loop(self) -> None:
+        """
+        The handle loop will start by performing the required handshake and identification.
+
+        The previous session is resumed if possible, otherwise a new session is identified.
+        Then this loop will wait on a new message, check if it is a interaction and schedule it
+        to be handled. Heartbeats are sent separately by the heartbeat task started here.
+        This returns once the websocket has closed.
+        """
+        await self._perform_handshake()
+        if self.can_resume:
+            await self._resume()
+        else:
+            await self._identify()
+
+        self._heartbeat_acked = True
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+        self._logger.debug("Beginning main handle loop")
+        try:
+            while True:
+                msg = await self._ws_session.receive()
+                if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    if (payload := self._decode(msg)) is not None:
+                        await self._handle_payload(payload)
+                elif msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    break
+        finally:
+            self._heartbeat_task.cancel()
+
+        self._logger.warning(f"Channel was closed with code {self._ws_session.close_code}")
+
+    async def _handle_payload(self, payload: dict) -> None:
+        """Act on a single payload received from the Gateway."""
+        op = payload["op"]
+        if op == 0:
+            self._sequence = payload["s"]
+            if payload["t"] == "READY":
+                self.session_id = payload["d"]["session_id"]
+                self.resume_gateway_url = payload["d"]["resume_gateway_url"]
+                self._ready = True
+                self._logger.info(f"Gateway session {self.session_id} is ready")
+                self._client._guilds_ready(payload["d"]["guilds"])
+            elif payload["t"] == "RESUMED":
+                self._ready = True
+                self._logger.info(f"Gateway session {self.session_id} resumed")
+            elif payload["t"] == "INTERACTION_CREATE":
+                interaction = Interaction.from_payload(payload["d"])
+                self._logger.debug(f"Received interaction for: {interaction.name}")
+                await self._client._schedule_interaction(interaction)
+            else:
+                self._client._dispatch_event(payload["t"], payload["d"])
+        elif op == 1:
+            self._logger.debug("Gateway requested a heartbeat")
+            await self._send_heartbeat()
+        elif op == 7:
+            self._logger.info("Gateway requested a reconnect")
+            await self._ws_session.close(code=4000)
+        elif op == 9:
+            if not payload["d"]:
+                self._invalidate_session()
+            self._logger.info(f"Gateway session was invalidated, resumable: {payload['d']}")
+            # Discord asks for a random wait between 1 and 5 seconds before identifying again.
+            await asyncio.sleep(random.uniform(1, 5))
+            await self._ws_session.close(code=4000)
+        elif op == 11:
+            self._heartbeat_ack()
+
+    async def connect_to_gateway(self) -> None:
+        """Connect to the gateway via Websocket."""
+        url = self.resume_gateway_url if self.can_resume and self.resume_gateway_url else self._client.url
+        url += f"/?v={API_VERSION}&encoding={self.encoding}"
+        if self.compress:
+            url += "&compress=zlib-stream"
+            self._decompressor = ZlibStreamDecompressor()
+
+        self._logger.debug(f"Connecting to Gateway {url}")
+        self._ws_session = await self._client._http_session.ws_connect(url)
+        self._logger.debug("Connected to Gateway")
+
+    async def _close(self) -> None:
+        """Close the websocket after the connection failed, so it can be replaced."""
+        if self._ws_session is not None and not self._ws_session.closed:
+            try:
+                await self._ws_session.close(code=4000)
+            except Exception as err:
+                self._logger.debug(f"Failed to close the websocket: {err!r}")
+
+    async def run(self) -> None:
+        """
+        Keep a connection to the Gateway open, reconnecting whenever it closes.
+
+        Sessions are resumed when possible and only identified again once the session is lost.
+        Failed connections, including unexpected errors handling a payload, are retried
+        with an exponential backoff. Commands are synced once
+        by `Client.run`, so reconnecting never repeats that work.
+        """
+        failures = 0
+        while True:
+            self._ready = False
+            try:
+                await self.connect_to_gateway()
+                await self.handle_loop()
+            except (ClientError, ConnectionError, asyncio.TimeoutError) as err:
+                self._logger.warning(f"Gateway connection failed: {err!r}")
+                await self._close()
+            except Exception:
+                # Such as a payload that cannot be decoded, one bad frame must not stop the shard.
+                self._logger.exception("Unexpected error on the Gateway connection")
+                await self._close()
+                # Back off even if the session was ready, the same error may happen again.
+                self._ready = False
+            else:
+                close_code = self._ws_session.close_code
+                if close_code in FATAL_CLOSE_CODES:
+                    self._logger.error(f"Gateway closed with unrecoverable code {close_code}, stopping")
+                    return
+                if close_code in INVALID_SESSION_CLOSE_CODES:
+                    self._invalidate_session()
+
+            if self._ready:
+                failures = 0
+                self._logger.info("Reconnecting to Gateway")
+                continue
+
+            failures += 1
+            backoff = min(self.max_backoff, 2 ** (failures - 1)) * random.uniform(0.5, 1)
+            self._logger.info(f"Reconnecting to Gateway in {backoff:.2f}s, attempt {failures}")
+            await asyncio.sleep(backoff)
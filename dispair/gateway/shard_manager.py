@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Awaitable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from dispair.gateway_client import GatewayClient
+
+# Seconds that must pass between two IDENTIFY payloads of the same max_concurrency bucket.
+IDENTIFY_INTERVAL = 5
+
+
+class ShardManager:
+    """
+    Spread the shards of a GatewayClient across worker processes.
+
+    Each worker runs its own event loop with a subset of the shards, the routers
+    attached to the client are inherited by every worker when it is forked.
+    """
+
+    def __init__(self, client: GatewayClient, workers: int):
+        self._client = client
+        self.shard_count = client.shard_count or client.shards
+        shard_ids = client.shard_ids if client.shard_ids is not None else range(self.shard_count)
+        self.workers = min(workers, len(shard_ids))
+        self.assignments = [list(shard_ids[index::self.workers]) for index in range(self.workers)]
+        self.start_delays = self._start_delays(shard_ids, client.max_concurrency)
+
+    @staticmethod
+    def _start_delays(shard_ids: list[int], max_concurrency: int) -> dict[int, float]:
+        """
+        Calculate how long each shard waits before connecting.
+
+        Shards share an identify bucket when `shard_id % max_concurrency` matches, only one
+        of them may identify every IDENTIFY_INTERVAL. Staggering the starts keeps the workers
+        within that limit without them needing to coordinate.
+        """
+        waves: dict[int, int] = {}
+        delays = {}
+        for shard_id in sorted(shard_ids):
+            bucket = shard_id % max_concurrency
+            delays[shard_id] = waves.get(bucket, 0) * IDENTIFY_INTERVAL
+            waves[bucket] = waves.get(bucket, 0) + 1
+        return delays
+
+    def _serve(self, index: int) -> Awaitable[None]:
+        """Run the shards assigned to a worker, this is called in the worker process."""
+        shard_ids = self.assignments[index]
+        self._client.shard_ids = shard_ids
+        return self._client._startup({shard_id: self.start_delays[shard_id] for shard_id in shard_ids})
+
+    def run(self) -> None:
+        """Run the shards across the worker processes, this blocks until every worker has stopped."""
+        # Each worker only knows about its own identifies, so the session start limit is split between them.
+        limit = self._client.session_start_limit
+        limit["remaining"] //= self.workers
+        limit["total"] //= self.workers
+
+        self._client._run_workers(self.workers, self._serve)
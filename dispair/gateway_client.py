@@ -1,107 +1,250 @@
 import asyncio
 import logging
-import platform
-
-from aiohttp import WSMsgType
+import time
+from collections import defaultdict
+from functools import reduce
+from typing import Awaitable, Callable, Literal, Optional
 
 from dispair.client import Client
-from dispair.constants import API_VERSION
+from dispair.constants import EVENT_INTENTS, Intents
 from dispair.exceptions import HandlerNotDefined
-from dispair.http import ApiPath
-from dispair.models import Interaction
+from dispair.gateway import Shard, ShardManager
+from dispair.gateway.shard_manager import IDENTIFY_INTERVAL
+from dispair.http import ApiPath, Priority
+from dispair.models import Interaction, Member
+
+EventListener = Callable[[dict], Awaitable[None]]
+
+# Events the GatewayClient always needs, none of them require any intents.
+INTERNAL_EVENTS = frozenset(("READY", "RESUMED", "INTERACTION_CREATE"))
+# Events used to keep track of the guilds the bot is a member of.
+GUILD_EVENTS = frozenset(("GUILD_CREATE", "GUILD_DELETE"))
+# Events used to keep the member cache warm.
+MEMBER_EVENTS = frozenset(("GUILD_MEMBER_ADD", "GUILD_MEMBER_UPDATE", "GUILD_MEMBER_REMOVE"))
 
 
 class GatewayClient(Client):
     """Client for usage with the DiscordAPI Gateway."""
 
-    url: str
+    url: Optional[str]
     shards: int
     session_start_limit: dict
+    max_concurrency: int
+
+    def __init__(self, bot_token: str, app_id: str, *, shard_count: Optional[int] = None,
+                 shard_ids: Optional[list[int]] = None, max_in_flight: Optional[int] = 100,
+                 latency_window: int = 10, max_backoff: float = 60, compress: bool = False,
+                 encoding: Literal["json", "etf"] = "json", intents: Optional[int] = None,
+                 track_guilds: bool = True, watch_members: bool = False, **kwargs):
+        """
+        Create a GatewayClient.
+
+        `shard_count` defaults to the number of shards recommended by Discord, and
+        `shard_ids` to every shard, set them to run a subset of the shards in this client.
+        Each INTERACTION_CREATE is dispatched as its own task so the websocket keeps
+        being read while handlers run, `max_in_flight` caps how many can run at once.
+        Passing None handles every interaction inline before reading the next message.
+        `latency_window` is how many heartbeat round trips are kept to calculate the latency.
+        `max_backoff` is the longest time, in seconds, waited between failed reconnects.
+        `compress` enables zlib-stream transport compression on the Gateway connections.
+        `encoding` is the Gateway payload encoding, either "json" or "etf" (Erlang term format).
+        `intents` overrides the intents derived from the events that have listeners.
+        `track_guilds` keeps the known guilds up to date from READY, GUILD_CREATE and GUILD_DELETE,
+        so guild commands are synced in the background as the bot joins guilds, not when
+        the first interaction arrives. This requires the GUILDS intent.
+        `watch_members` keeps the `member_cache` up to date from guild member events, this
+        requires the privileged GUILD_MEMBERS intent to be enabled for the application.
+        """
+        super().__init__(bot_token, app_id, **kwargs)
+        assert max_in_flight is None or max_in_flight > 0, "max_in_flight must be a positive integer or None"
+        self.max_in_flight = max_in_flight
+        self._in_flight: set[asyncio.Task] = set()
+        self._in_flight_limit: Optional[asyncio.Semaphore] = None
+
+        self.url = None
+        self.max_concurrency = 1
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.latency_window = latency_window
+        self.max_backoff = max_backoff
+        self.compress = compress
+        self.encoding = encoding
+        self._shards: dict[int, Shard] = {}
+        self._identify_locks: dict[int, asyncio.Lock] = {}
+        self._identified_at: dict[int, float] = {}
+
+        self._intents = intents
+        self._listeners: dict[str, list[EventListener]] = defaultdict(list)
+        self._listener_tasks: set[asyncio.Task] = set()
+        self.track_guilds = track_guilds
+        self.events = INTERNAL_EVENTS | GUILD_EVENTS if track_guilds else INTERNAL_EVENTS
+        if watch_members:
+            assert self.member_cache is not None, "watch_members requires a member_cache"
+            self.events = self.events | MEMBER_EVENTS
+
+    @property
+    def intents(self) -> Intents:
+        """
+        Get the intents used to identify.
 
-    async def _perform_handshake(self) -> None:
-        self._logger.debug("Awaiting first message")
-        msg = await self._ws_session.receive()
-        self._logger.debug("Received first message")
-        payload = msg.json()
-        assert payload["op"] == 10, "Gateway did not respond with handshake"
-        self.heartbeat_interval_ms = payload["d"]["heartbeat_interval"]
-        self._logger.debug("Waiting heartbeat interval")
-        # await asyncio.sleep((self.heartbeat_interval_ms * random.random()) / 1_000)
-
-    async def _identify(self) -> None:
-        self._logger.debug("Identifying through Gateway")
-        await self._ws_session.send_json({
-            "op": 2,
-            "d": {
-                "token": self.bot_token,
-                "intents": 513,
-                "properties": {
-                    "$os": platform.system(),
-                    "$browser": "Dispair",
-                    "$device": "Dispair"
-                }
-            }
-        })
-
-    async def handle_loop(self) -> None:
+        Unless they were given explicitly, these are only the intents required by the events
+        that have listeners and guild tracking. Interactions do not require any intents.
         """
-        The handle loop will start by performing the required handshake and identification.
+        if self._intents is not None:
+            return Intents(self._intents)
+        return reduce(Intents.__or__, (EVENT_INTENTS.get(event, Intents.NONE) for event in self.events), Intents.NONE)
 
-        Then this loop will wait on a new message, check if it is a interaction and act on it.
-        If there isn't an interaction a Heartbeat will be sent instead.
+    def add_listener(self, event: str, listener: EventListener) -> None:
         """
-        await self._perform_handshake()
-        await self._identify()
-
-        self._logger.debug("Beginning main handle loop")
-        while self._loop.is_running():
-            try:
-                msg = await self._ws_session.receive(timeout=self.heartbeat_interval_ms / 1_000)
-                if msg.type == WSMsgType.TEXT:
-                    payload = msg.json()
-                    if payload["t"] == "INTERACTION_CREATE":
-                        data = payload["d"]
-                        interaction = Interaction(
-                            _id=data["id"],
-                            application_id=data["application_id"],
-                            _type=data["type"],
-                            data=data["data"],
-                            guild_id=data["guild_id"],
-                            channel_id=data["channel_id"],
-                            member=data["member"],
-                            user=data["member"]["user"],
-                            token=data["token"],
-                        )
-                        self._logger.debug(f"Received interaction for: {interaction.name}")
-                        try:
-                            response = await self.handle(interaction)
-                        except HandlerNotDefined:
-                            self._logger.info(f"No handler defined for interaction: {interaction.name}")
-                            continue
-
-                        await self._http_session.request(
-                            "POST",
-                            ApiPath(
-                                "/interactions/{interaction_id}/{interaction_token}/callback",
-                                interaction_id=interaction.id,
-                                interaction_token=interaction.token,
-                            ),
-                            json=response.json()
-                        )
-                elif msg.type == WSMsgType.CLOSED:
-                    break
-
-            except asyncio.TimeoutError:
-                self._logger.info("Sending heartbeat message")
-                await self._ws_session.send_json({"op": 1})
-
-        self._logger.error("Channel was closed")
-
-    async def connect_to_gateway(self) -> None:
-        """Connect to the gateway via Websocket."""
-        self._logger.debug("Connecting to Gateway")
-        self._ws_session = await self._http_session.ws_connect(self.url + f"/?v={API_VERSION}&encoding=json")
-        self._logger.debug("Connected to Gateway")
+        Call a coroutine function with the data of every `event` dispatch.
+
+        Only events with listeners are decoded, others are dropped as soon as their name is known.
+        Listeners added after the shards have identified will not change the intents being used.
+        """
+        event = event.upper()
+        self._listeners[event].append(listener)
+        self.events = self.events | {event}
+
+    def listen(self, event: str) -> Callable[[EventListener], EventListener]:
+        """Decorator to add an event listener."""
+        def decorator(listener: EventListener) -> EventListener:
+            self.add_listener(event, listener)
+            return listener
+        return decorator
+
+    def _guilds_ready(self, guilds: list[dict]) -> None:
+        """Add the guilds listed in a READY payload to the known guilds."""
+        if self.track_guilds:
+            for guild in guilds:
+                self._discover_guild(int(guild["id"]))
+
+    def _dispatch_event(self, event: str, data: dict) -> None:
+        """Schedule the listeners of a Gateway event."""
+        if event == "GUILD_CREATE":
+            if self.track_guilds:
+                self._discover_guild(int(data["id"]))
+        elif event == "GUILD_DELETE":
+            # An unavailable guild is an outage, the bot is only removed when unavailable is not set.
+            if self.track_guilds and not data.get("unavailable"):
+                self._forget_guild(int(data["id"]))
+        elif event in MEMBER_EVENTS and self.member_cache is not None:
+            member = dict(data)
+            guild_id = int(member.pop("guild_id"))
+            if event == "GUILD_MEMBER_REMOVE":
+                self.member_cache.remove(guild_id, int(member["user"]["id"]))
+            else:
+                self.member_cache.put(Member(guild_id=guild_id, **member))
+
+        for listener in self._listeners.get(event, ()):
+            task = asyncio.create_task(self._call_listener(event, listener, data))
+            self._listener_tasks.add(task)
+            task.add_done_callback(self._listener_tasks.discard)
+
+    async def _call_listener(self, event: str, listener: EventListener, data: dict) -> None:
+        try:
+            await listener(data)
+        except Exception:
+            self._logger.exception(f"Listener for {event} raised an exception")
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Get the average heartbeat round trip time, in seconds, across all shards."""
+        latencies = [latency for latency in self.latencies.values() if latency is not None]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+    @property
+    def latencies(self) -> dict[int, Optional[float]]:
+        """Get the average heartbeat round trip time, in seconds, of each shard."""
+        return {shard_id: shard.latency for shard_id, shard in self._shards.items()}
+
+    def get_shard(self, shard_id: int) -> Optional[Shard]:
+        """Get a shard running in this client."""
+        return self._shards.get(shard_id)
+
+    def shard_for(self, guild_id: int) -> int:
+        """Get the shard id that receives the events of a guild."""
+        return (guild_id >> 22) % (self.shard_count or self.shards)
+
+    async def _wait_to_identify(self, shard_id: int) -> None:
+        """
+        Wait until a shard is allowed to identify.
+
+        Only one shard per max_concurrency bucket may identify every IDENTIFY_INTERVAL,
+        and no more than the session start limit may identify before it resets.
+        """
+        bucket = shard_id % self.max_concurrency
+        lock = self._identify_locks.setdefault(bucket, asyncio.Lock())
+        async with lock:
+            if (identified_at := self._identified_at.get(bucket)) is not None:
+                if (wait := identified_at + IDENTIFY_INTERVAL - time.monotonic()) > 0:
+                    await asyncio.sleep(wait)
+
+            limit = self.session_start_limit
+            if limit["remaining"] <= 0:
+                self._logger.warning(f"Session start limit reached, waiting {limit['reset_after']}ms to identify")
+                await asyncio.sleep(limit["reset_after"] / 1_000)
+                limit["remaining"] = limit["total"]
+            limit["remaining"] -= 1
+            self._identified_at[bucket] = time.monotonic()
+
+    async def _schedule_interaction(self, interaction: Interaction) -> None:
+        """
+        Dispatch an interaction without blocking the handle loop.
+
+        This only waits when `max_in_flight` interactions are already being handled,
+        which applies back pressure to the websocket instead of growing without bound.
+        """
+        if self.max_in_flight is None:
+            await self._dispatch_interaction(interaction)
+            return
+
+        if self._in_flight_limit is None:
+            self._in_flight_limit = asyncio.Semaphore(self.max_in_flight)
+
+        await self._in_flight_limit.acquire()
+        task = asyncio.create_task(self._dispatch_interaction(interaction))
+        self._in_flight.add(task)
+        task.add_done_callback(self._interaction_done)
+
+    def _interaction_done(self, task: asyncio.Task) -> None:
+        self._in_flight.discard(task)
+        self._in_flight_limit.release()
+
+    async def _dispatch_interaction(self, interaction: Interaction) -> None:
+        """Handle an interaction and send the response to the interaction callback."""
+        try:
+            response = await self.respond(interaction)
+        except HandlerNotDefined:
+            self._logger.info(f"No handler defined for interaction: {interaction.name}")
+            return
+        except Exception:
+            self._logger.exception(f"Handler for interaction {interaction.name} raised an exception")
+            return
+
+        try:
+            await self._http_session.request(
+                "POST",
+                ApiPath(
+                    "/interactions/{interaction_id}/{interaction_token}/callback",
+                    interaction_id=interaction.id,
+                    interaction_token=interaction.token,
+                ),
+                data=response.encode(self.json_codec),
+                priority=Priority.INTERACTION
+            )
+        except Exception:
+            self._acknowledge(interaction, False)
+            self._logger.exception(f"Failed to send the response for interaction {interaction.name}")
+        else:
+            self._acknowledge(interaction)
+
+    async def _drain_in_flight(self) -> None:
+        """Wait for the interactions that are currently being handled to finish."""
+        if self._in_flight:
+            self._logger.debug(f"Waiting on {len(self._in_flight)} in flight interactions")
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
 
     async def get_gateway(self) -> None:
         """Request the current gateway endpoint and meta data from DiscordAPI."""
@@ -111,21 +254,54 @@ class GatewayClient(Client):
         self.url = req["url"]
         self.shards = req["shards"]
         self.session_start_limit = req["session_start_limit"]
+        self.max_concurrency = self.session_start_limit.get("max_concurrency", 1)
+
+    async def _run_shard(self, shard: Shard, start_delay: float = 0) -> None:
+        if start_delay:
+            await asyncio.sleep(start_delay)
+        await shard.run()
 
-    async def _startup(self) -> None:
+    async def _startup(self, start_delays: Optional[dict[int, float]] = None) -> None:
         self._logger.debug("Starting up GatewayClient")
-        await self.get_gateway()
-        await self.connect_to_gateway()
-        await self.handle_loop()
-        await self._shutdown()
+        if self.url is None:
+            await self.get_gateway()
+
+        shard_count = self.shard_count or self.shards
+        shard_ids = self.shard_ids if self.shard_ids is not None else range(shard_count)
+        self._shards = {
+            shard_id: Shard(
+                self, shard_id, shard_count,
+                latency_window=self.latency_window, max_backoff=self.max_backoff,
+                compress=self.compress, encoding=self.encoding
+            )
+            for shard_id in shard_ids
+        }
+        self._logger.info(f"Starting shards {list(self._shards)} of {shard_count}")
+
+        start_delays = start_delays or {}
+        try:
+            await asyncio.gather(*(self._run_shard(shard, start_delays.get(shard_id, 0))
+                                   for shard_id, shard in self._shards.items()))
+        finally:
+            await self._drain_in_flight()
+            await self._shutdown()
 
     async def _shutdown(self) -> None:
         """Shut down the bot, closing the http session and other open resources."""
         await super().shutdown()
 
-    def run(self) -> None:
-        """Begin the bot, this will block until the bot has stopped."""
+    def run(self, workers: int = 1) -> None:
+        """
+        Begin the bot, this will block until the bot has stopped.
+
+        With more than one worker the shards are spread across that many processes by a ShardManager.
+        """
         super().run()
 
         self._logger.log(logging.DEBUG, "Starting to run GatewayClient")
-        asyncio.get_event_loop().run_until_complete(self._startup())
+        loop = self._loop
+        if workers > 1:
+            loop.run_until_complete(self.get_gateway())
+            ShardManager(self, workers).run()
+        else:
+            loop.run_until_complete(self._startup())
@@ -1 +1 @@
-from .http_session import ApiPath
+from .http_session import ApiPath, HttpSession, Priority
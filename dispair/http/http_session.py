@@ -6,74 +6,229 @@ https://github.com/vcokltfre/Corded/blob/master/corded/http
 
 import asyncio
 import logging
-import math
 import time
-from asyncio import Lock, AbstractEventLoop
-from typing import Optional, Literal, Union
+from asyncio import AbstractEventLoop
+from collections import OrderedDict
+from enum import IntEnum
+from typing import Literal, Mapping, Optional
 
-from aiohttp import ClientSession, ClientWebSocketResponse, ClientResponseError
+from aiohttp import ClientSession, ClientTimeout, ClientWebSocketResponse, ClientResponseError, TCPConnector
 
+from .. import deadline
+from ..codec import JsonCodec, STDLIB
 from ..constants import API_VERSION
 
 
-class LockContext:
-    """Context manager for RateLimiting lock, Allows for releasing after `n` time."""
+class Priority(IntEnum):
+    """Priority of a request, each priority has its own budget of connections."""
 
-    def __init__(self, lock: Lock):
-        self._logger = logging.getLogger("Lock")
-        self._logger.setLevel(logging.DEBUG)
-        self._lock = lock
-        self._acquired = False
+    INTERACTION = 0
+    DEFAULT = 1
+    BACKGROUND = 2
 
-    async def __aenter__(self):
-        await self._lock.acquire()
-        self._acquired = True
-        return self
 
-    async def __aexit__(self, *argsb):
-        if self._acquired:
-            self._lock.release()
-            self._acquired = False
+# Connections each priority may use at once, together they fit in aiohttp's default connection limit.
+LANE_LIMITS = {Priority.INTERACTION: 60, Priority.DEFAULT: 30, Priority.BACKGROUND: 10}
 
-    def __exit__(self, *args):
-        if self._acquired:
-            self._lock.release()
-            self._acquired = False
 
-    async def release_at(self, unix_time: Union[int, float]) -> None:
-        """Release the lock at a specific time."""
-        seconds = math.ceil(unix_time - time.time())
-        self._logger.debug(f"Releasing lock in {seconds} seconds")
-        await asyncio.sleep(seconds)
-        self._lock.release()
-        self._acquired = False
+def scale_lane_limits(connections: int) -> dict[Priority, int]:
+    """Scale the default lane limits to a pool of `connections`, a pool of 0 is unlimited and keeps them."""
+    if connections <= 0:
+        return dict(LANE_LIMITS)
+    total = sum(LANE_LIMITS.values())
+    return {priority: max(1, limit * connections // total) for priority, limit in LANE_LIMITS.items()}
 
 
-class RateLimiter:
-    """Discord RateLimiter that uses buckets based on the requested data."""
+class Bucket:
+    """
+    Rate limit state of a single bucket, as reported by Discord.
+
+    Up to `remaining` requests may be in flight at once. A bucket that has not been
+    reported yet only allows one request, until its response reveals the limit.
+    Once exhausted, requests wait on a single timer that wakes them when the window resets,
+    the request that exhausted the bucket is never held up.
+    """
 
     def __init__(self):
-        self._logger = logging.getLogger("RateLimiter")
-        self._logger.setLevel(logging.DEBUG)
-        self._locks: dict[str, Lock] = {}
+        self.limit: Optional[int] = 1
+        self.remaining = 1
+        self.reset_at = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+        self._released = asyncio.Event()
+        self._reset_handle: Optional[asyncio.TimerHandle] = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.remaining}/{self.limit}, {self._in_flight} in flight>"
+
+    @property
+    def idle(self) -> bool:
+        """Get if the bucket is unused and its window has reset, so forgetting it loses nothing."""
+        return (
+            self._in_flight == 0 and self._waiting == 0
+            and (self.limit is None or time.monotonic() >= self.reset_at)
+        )
+
+    async def acquire(self) -> None:
+        """Wait until a request can be made in this bucket."""
+        while True:
+            now = time.monotonic()
+            if self.limit is None:
+                break
+            if now >= self.reset_at:
+                # The window has reset, only the requests still in flight count against the limit.
+                self.remaining = max(self.remaining, self.limit - self._in_flight)
+            if self.remaining > 0:
+                self.remaining -= 1
+                break
+
+            if self.reset_at > now and self._reset_handle is None:
+                self._reset_handle = asyncio.get_running_loop().call_later(self.reset_at - now, self._wake)
+
+            self._waiting += 1
+            try:
+                await self._released.wait()
+            finally:
+                self._waiting -= 1
+
+        self._in_flight += 1
+
+    def release(self, headers: Optional[Mapping[str, str]] = None, status: Optional[int] = None) -> None:
+        """Release a request made in this bucket, updating the bucket from its response headers."""
+        self._in_flight -= 1
+        if headers is not None:
+            if "X-RateLimit-Limit" in headers:
+                self.limit = int(headers["X-RateLimit-Limit"])
+                # Requests still in flight have not been counted by Discord yet.
+                self.remaining = max(0, int(headers["X-RateLimit-Remaining"]) - self._in_flight)
+                self.reset_at = time.monotonic() + float(headers["X-RateLimit-Reset-After"])
+            elif self.limit == 1 and self.reset_at == 0 and status is not None and 200 <= status < 300:
+                # The route is not rate limited, only a successful response can show that.
+                self.limit = None
+        self._wake()
+
+    def _wake(self) -> None:
+        """Wake every waiting request, so they check the bucket again."""
+        if self._reset_handle is not None:
+            self._reset_handle.cancel()
+            self._reset_handle = None
+        self._released.set()
+        self._released = asyncio.Event()
+
+    def rate_limited(self, retry_after: float) -> None:
+        """Mark the bucket as exhausted for `retry_after` seconds, after a 429 response."""
+        if self.limit is None:
+            self.limit = 1
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + retry_after)
 
-    def __getitem__(self, item: str) -> LockContext:
-        """Get the appropriate lock or create a new one."""
-        return self.get(item)
 
-    def get(self, item: str) -> LockContext:
-        """Get the appropriate lock or create a new one."""
-        if lock := self._locks.get(item):
-            self._logger.debug(f"<{item}> Acquired lock")
-            return LockContext(lock)
+class RateLimiter:
+    """
+    Discord RateLimiter that uses the buckets reported by Discord.
 
-        self._logger.debug(f"<{item}> Generating new lock")
-        self._locks[item] = Lock()
-        return LockContext(self._locks[item])
+    Routes are mapped to the bucket hash from their `X-RateLimit-Bucket` header, each bucket
+    is split by the major parameters of the request. Until a route's bucket is known, its
+    requests use a bucket of their own. The global rate limit pauses every request.
+
+    Buckets are forgotten once they are idle, so state for interaction tokens does not build up.
+    Routes that Discord does not rate limit share a single bucket. Idle buckets are swept every
+    `sweep_interval` seconds, or sooner once there are more than `max_buckets`.
+    """
+
+    def __init__(self, *, max_buckets: int = 1_000, sweep_interval: float = 60):
+        self.max_buckets = max_buckets
+        self.sweep_interval = sweep_interval
+        self._logger = logging.getLogger("RateLimiter")
+        self._routes: dict[str, str] = {}
+        self._unlimited_routes: set[str] = set()
+        self._unlimited = Bucket()
+        self._unlimited.limit = None
+        self._buckets: OrderedDict[str, Bucket] = OrderedDict()
+        self._global_reset_at = 0.0
+        self._global_released: Optional[asyncio.Event] = None
+        self._swept_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get(self, method: str, path: "ApiPath") -> Bucket:
+        """Get the bucket for a request, creating one if it does not exist."""
+        route = f"{method} {path.route}"
+        if route in self._unlimited_routes:
+            return self._unlimited
+
+        key = f"{self._routes.get(route, route)}:{path.major_parameters}"
+        if (bucket := self._buckets.get(key)) is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+
+        if len(self._buckets) >= self.max_buckets or time.monotonic() - self._swept_at >= self.sweep_interval:
+            self.sweep()
+        bucket = self._buckets[key] = Bucket()
+        return bucket
+
+    def sweep(self) -> None:
+        """Forget every idle bucket."""
+        self._swept_at = time.monotonic()
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle]:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_buckets:
+            self._logger.debug(f"{len(self._buckets)} rate limit buckets are in use, exceeding {self.max_buckets}")
+
+    def release(self, method: str, path: "ApiPath", bucket: Bucket, headers: Optional[Mapping[str, str]],
+                status: Optional[int] = None) -> None:
+        """Release a request, learning the bucket of its route from the response headers."""
+        route = f"{method} {path.route}"
+        if bucket is self._unlimited:
+            bucket.release()
+            if headers is not None and "X-RateLimit-Limit" in headers:
+                self._unlimited_routes.discard(route)
+            return
+
+        if headers is not None and (bucket_hash := headers.get("X-RateLimit-Bucket")) is not None:
+            if self._routes.get(route) != bucket_hash:
+                self._logger.debug(f"Route {route} uses bucket {bucket_hash}")
+                self._routes[route] = bucket_hash
+                self._buckets.setdefault(f"{bucket_hash}:{path.major_parameters}", bucket)
+
+        bucket.release(headers, status)
+        if bucket.limit is None:
+            self._logger.debug(f"Route {route} is not rate limited")
+            self._unlimited_routes.add(route)
+
+    def rate_limited(self, method: str, path: "ApiPath", bucket: Bucket, retry_after: float) -> None:
+        """Mark the bucket of a request as exhausted for `retry_after` seconds, after a 429 response."""
+        if bucket is self._unlimited:
+            self._unlimited_routes.discard(f"{method} {path.route}")
+            bucket = self.get(method, path)
+        bucket.rate_limited(retry_after)
+
+    async def wait_global(self) -> None:
+        """Wait until the global rate limit has reset."""
+        while self._global_released is not None:
+            await self._global_released.wait()
+
+    def limit_globally(self, retry_after: float) -> None:
+        """Pause every request for `retry_after` seconds, with a single timer to resume them."""
+        self._logger.warning(f"Hit the global rate limit, pausing requests for {retry_after}s")
+        if time.monotonic() + retry_after <= self._global_reset_at:
+            return
+
+        self._global_reset_at = time.monotonic() + retry_after
+        if self._global_released is None:
+            self._global_released = asyncio.Event()
+        asyncio.get_running_loop().call_later(retry_after, self._release_global, self._global_reset_at)
+
+    def _release_global(self, reset_at: float) -> None:
+        # A later global rate limit may have extended the pause, its own timer releases it.
+        if reset_at == self._global_reset_at and self._global_released is not None:
+            self._global_released.set()
+            self._global_released = None
 
 
 class ApiPath:
-    """Represent the APIPath, used to generate Bucket strings."""
+    """Represent the APIPath, used to find the rate limit bucket of a request."""
 
     def __init__(self, path: str, **params):
         self.path = path.format(**params)
@@ -86,43 +241,99 @@ class ApiPath:
         return HttpSession.api_base + self.path
 
     @property
-    def bucket(self) -> str:
-        """Get the bucket string to use for rate limiting."""
+    def route(self) -> str:
+        """Get the path before its parameters are filled in."""
+        return self._raw_path
+
+    @property
+    def major_parameters(self) -> str:
+        """
+        Get the parameters that Discord splits rate limit buckets by.
+
+        An interaction token is the token of the application's webhook, so it is a major parameter.
+        """
         guild_id = self.params.get("guild_id", 0)
         channel_id = self.params.get("channel_id", 0)
         webhook_id = self.params.get("webhook_id", 0)
-        interaction_id = self.params.get("interaction_id", 0)
         interaction_token = self.params.get("interaction_token", 0)
 
-        return f"{guild_id}-{channel_id}-{webhook_id}-{interaction_id}-{interaction_token}::{self._raw_path}"
+        return f"{guild_id}-{channel_id}-{webhook_id}-{interaction_token}"
 
 
 class HttpSession:
-    """HTTPSession containing a aiohttp.ClientSession with Rate Limits."""
+    """
+    HTTPSession containing a aiohttp.ClientSession with Rate Limits.
+
+    Requests are made in lanes by their priority, a lane only has `lane_limits[priority]`
+    connections. The lanes are scaled to the connection pool and must fit in it together,
+    so background work such as command syncs can never take the connections needed to
+    respond to interactions. A pool with fewer connections than lanes is shared, the
+    lowest priorities share first.
+
+    Connections are pooled and kept alive for `keepalive_timeout` seconds, at most
+    `connection_limit` are open at once, or `connection_limit_per_host` to each host when set.
+    Websockets are opened outside of this pool, see `ws_connect`. DNS lookups are cached for
+    `dns_cache_ttl` seconds.
+    """
 
     api_base = f"https://discord.com/api/v{API_VERSION}/"
 
-    def __init__(self, bot_token: Optional[str] = None, *, loop: AbstractEventLoop = None):
+    def __init__(self, bot_token: Optional[str] = None, *, loop: AbstractEventLoop = None,
+                 codec: JsonCodec = STDLIB, timeout: float = 30, max_retries: int = 3,
+                 lane_limits: Optional[dict[Priority, int]] = None, connection_limit: int = 100,
+                 connection_limit_per_host: int = 0, keepalive_timeout: float = 60,
+                 dns_cache_ttl: Optional[int] = 300):
         self.rate_limiter = RateLimiter()
+        # Every request goes to the same host, so the smaller of the two limits bounds the pool.
+        pool = min((limit for limit in (connection_limit, connection_limit_per_host) if limit > 0), default=0)
+        self.lane_limits = {**scale_lane_limits(pool), **(lane_limits or {})}
+        self._lanes = {priority: asyncio.Semaphore(limit) for priority, limit in self.lane_limits.items()}
+        if pool and (needed := sum(self.lane_limits.values())) > pool:
+            if lane_limits:
+                raise ValueError(
+                    f"Lane limits need {needed} connections, but the connection pool only has {pool}, "
+                    f"raise connection_limit or lower the lane limits"
+                )
+            # Too few connections for one in each lane, the lower priorities share a connection.
+            shared = self._lanes[Priority.DEFAULT] if pool > 1 else self._lanes[Priority.INTERACTION]
+            self._lanes[Priority.DEFAULT] = self._lanes[Priority.BACKGROUND] = shared
+        self.codec = codec
+        self.timeout = timeout
+        self.max_retries = max_retries
         self.loop = loop or asyncio.get_event_loop()
+        self.keepalive_timeout = keepalive_timeout
         self._logger = logging.getLogger("http_session")
         self._logger.setLevel(logging.DEBUG)
-
+        self._last_request_at = 0.0
+        self._keep_warm_task: Optional[asyncio.Task] = None
+        self._ws_client: Optional[ClientSession] = None
+
+        connector = TCPConnector(
+            limit=connection_limit,
+            limit_per_host=connection_limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_cache_ttl,
+            loop=self.loop
+        )
         if bot_token:
             self._session = ClientSession(
                 headers={
                     "Authorization": f"Bot {bot_token}",
                     "Content-Type": "application/json"
                 },
+                connector=connector,
+                timeout=ClientTimeout(total=timeout),
                 loop=self.loop
             )
         else:
-            self._session = ClientSession(loop=self.loop)
+            self._session = ClientSession(connector=connector, timeout=ClientTimeout(total=timeout), loop=self.loop)
 
     async def request(
             self,
-            method: Literal["GET", "POST", "DELETE"],
+            method: Literal["GET", "POST", "PATCH", "DELETE"],
             path: ApiPath,
+            *,
+            priority: Priority = Priority.DEFAULT,
             **kwargs
     ) -> Optional[dict]:
         """
@@ -130,34 +341,104 @@ class HttpSession:
 
         If the request hits the Discord Rate Limit, the
         request will wait until the Rate Limit has been
-        passed.
+        passed. Requests that are rate limited anyway are
+        retried up to `max_retries` times. A `json` body is
+        encoded with the session's codec.
+
+        Requests made while handling an interaction give up once the interaction's
+        deadline has passed, raising an asyncio.TimeoutError.
         """
-        async with self.rate_limiter[path.bucket] as lock:
-            resp = await self._session.request(method, path.url, **kwargs)
+        if "json" in kwargs:
+            kwargs["data"] = self.codec.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {"Content-Type": "application/json", **kwargs.get("headers", {})}
+
+        if (remaining := deadline.remaining()) is not None:
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"Interaction deadline passed before requesting {path.path}")
+            return await asyncio.wait_for(self._request(method, path, priority, **kwargs), remaining)
+        return await self._request(method, path, priority, **kwargs)
+
+    async def _request(self, method: str, path: ApiPath, priority: Priority, **kwargs) -> Optional[dict]:
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.wait_global()
+            bucket = self.rate_limiter.get(method, path)
+            await bucket.acquire()
+            headers = status = None
+            self._last_request_at = time.monotonic()
+            try:
+                async with self._lanes[priority]:
+                    resp = await self._session.request(method, path.url, **kwargs)
+                    headers, status = resp.headers, resp.status
+                    body = await resp.read()
+            finally:
+                self.rate_limiter.release(method, path, bucket, headers, status)
 
             if resp.content_type == "application/json":
-                content = await resp.json()
+                content = self.codec.loads(body)
             else:
                 self._logger.debug(f"Received response content_type: {resp.content_type}")
+                content = None
+
+            if resp.status == 429 and attempt < self.max_retries:
+                content = content or {}
+                retry_after = float(content.get("retry_after", resp.headers.get("Retry-After", 1)))
+                if content.get("global") or resp.headers.get("X-RateLimit-Global") == "true":
+                    self.rate_limiter.limit_globally(retry_after)
+                else:
+                    self.rate_limiter.rate_limited(method, path, bucket, retry_after)
+                self._logger.warning(f"Rate limited on {method} {path.route}, retrying in {retry_after}s")
+                continue
+
+            if content is None:
                 return
             try:
                 resp.raise_for_status()
             except ClientResponseError as err:
                 self._logger.error(str(err))
                 raise err
+            return content
+
+    async def warm(self, connections: int) -> None:
+        """Open keep-alive connections to the DiscordAPI, so requests do not wait on DNS and handshakes."""
+        async def connect() -> None:
+            async with self._session.get(self.api_base + "gateway") as resp:
+                await resp.read()
+
+        self._last_request_at = time.monotonic()
+        results = await asyncio.gather(*(connect() for _ in range(connections)), return_exceptions=True)
+        if failed := [result for result in results if isinstance(result, Exception)]:
+            self._logger.warning(f"Failed to warm {len(failed)} of {connections} connections: {failed[0]!r}")
+        else:
+            self._logger.debug(f"Warmed {connections} connections")
 
-            remaining = resp.headers.get("x-ratelimit-remaining", "1")
-
-            if int(remaining) == 0:
-                reset = resp.headers["x-ratelimit-reset"]
-                await lock.release_at(float(reset))
+    def keep_warm(self, connections: int) -> None:
+        """Keep `connections` connections open, warming them again before an idle pool closes them."""
+        if self._keep_warm_task is None:
+            self._keep_warm_task = self.loop.create_task(self._keep_warm(connections))
 
-        return content
+    async def _keep_warm(self, connections: int) -> None:
+        interval = self.keepalive_timeout / 2
+        while True:
+            if time.monotonic() - self._last_request_at >= interval:
+                await self.warm(connections)
+            await asyncio.sleep(interval)
 
     async def ws_connect(self, url: str, **kwargs) -> ClientWebSocketResponse:
-        """Expose the `ws_connect` method of the session cleanly."""
-        return await self._session.ws_connect(url, **kwargs)
+        """
+        Connect to a websocket.
+
+        A websocket holds its connection for as long as it is open, so websockets are opened
+        through their own session and never take connections from the lanes.
+        """
+        if self._ws_client is None:
+            self._ws_client = ClientSession(loop=self.loop)
+        return await self._ws_client.ws_connect(url, **kwargs)
 
     async def kill(self) -> None:
         """Close the HttpSession."""
+        if self._keep_warm_task is not None:
+            self._keep_warm_task.cancel()
+            self._keep_warm_task = None
+        if self._ws_client is not None:
+            await self._ws_client.close()
         await self._session.close()
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dispair.models.member import Member
+
+
+class MemberCache:
+    """
+    Bounded cache of guild members, keyed by (guild_id, user_id).
+
+    The least recently used member is evicted once `max_size` is reached,
+    and members are dropped once they are older than `ttl` seconds.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: Optional[float] = 3_600):
+        assert max_size > 0, "MemberCache max_size must be positive"
+        self.max_size = max_size
+        self.ttl = ttl
+        self._members: OrderedDict[tuple[int, int], tuple[float, Member]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def get(self, guild_id: Optional[int], user_id: int) -> Optional[Member]:
+        """Get a cached member, None if it is not cached or has expired."""
+        key = (guild_id, user_id)
+        if (entry := self._members.get(key)) is None:
+            return None
+
+        cached_at, member = entry
+        if self.ttl is not None and time.monotonic() - cached_at > self.ttl:
+            del self._members[key]
+            return None
+
+        self._members.move_to_end(key)
+        return member
+
+    def put(self, member: Member) -> None:
+        """Add or refresh a member in the cache."""
+        key = (member.guild_id, member.id)
+        self._members[key] = (time.monotonic(), member)
+        self._members.move_to_end(key)
+        if len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+    def remove(self, guild_id: Optional[int], user_id: int) -> None:
+        """Remove a member from the cache."""
+        self._members.pop((guild_id, user_id), None)
@@ -1,4 +1,4 @@
-from dispair.models import Interaction
+from dispair.models import Interaction, Response
 
 
 class MissingHandler:
@@ -8,6 +8,11 @@ class MissingHandler:
     This can be subclassed to add your own missing handler functionality.
     """
 
-    async def handle(self, inter: Interaction, *args, **kwargs) -> str:
-        """Handle an interaction that does not exist."""
-        return f"> Command {inter.name} is not supported"
+    def __init__(self):
+        self._responses: dict[str, Response] = {}
+
+    async def handle(self, inter: Interaction, *args, **kwargs) -> Response:
+        """Handle an interaction that does not exist, reusing the encoded reply for each command."""
+        if (response := self._responses.get(inter.name)) is None:
+            response = self._responses[inter.name] = Response(f"> Command {inter.name} is not supported").freeze()
+        return response
@@ -1,5 +1,7 @@
+from .channel import Channel
 from .handler import Handler
 from .interaction import Interaction
 from .member import Member
 from .option import Option
-from .response import Response
+from .response import DeferredResponse, Response
+from .role import Role
@@ -0,0 +1,24 @@
+class Channel:
+    """
+    Discord Channel.
+
+    https://discord.com/developers/docs/resources/channel#channel-object
+    """
+
+    __slots__ = ("id", "guild_id", "name", "type", "parent_id", "permissions")
+
+    def __init__(self, _id: int, guild_id: int, **data):
+        self.id = int(_id)
+        self.guild_id = guild_id
+        self.name = data.get("name")
+        self.type = data.get("type")
+        self.parent_id = int(data["parent_id"]) if data.get("parent_id") else None
+        self.permissions = data.get("permissions")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.id}>"
+
+    @property
+    def mention(self) -> str:
+        """Get the mention string for the Channel."""
+        return f"<#{self.id}>"
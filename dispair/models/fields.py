@@ -0,0 +1,28 @@
+from typing import Any, Optional
+
+
+class LazyInt:
+    """
+    Integer field parsed from its raw payload value the first time it is read.
+
+    The raw value is kept in the slot named `slot` and replaced by the parsed int,
+    so ids that are never read are never converted.
+    """
+
+    __slots__ = ("slot",)
+
+    def __init__(self, slot: str):
+        self.slot = slot
+
+    def __get__(self, instance: Any, owner: type) -> Any:
+        if instance is None:
+            return self
+
+        value: Optional[Any] = getattr(instance, self.slot)
+        if value is not None and type(value) is not int:
+            value = int(value)
+            setattr(instance, self.slot, value)
+        return value
+
+    def __set__(self, instance: Any, value: Any) -> None:
+        setattr(instance, self.slot, value)
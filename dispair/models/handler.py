@@ -1,10 +1,53 @@
+from __future__ import annotations
+
+import inspect
 from abc import ABC, abstractmethod
-from typing import Callable, get_type_hints, Union, get_origin, get_args
+from typing import Any, Callable, Optional, get_type_hints, Union, get_origin, get_args
 
+from dispair.exceptions import MissingOptions
+from .channel import Channel
 from .interaction import Interaction
 from .member import Member
 from .option import Option
 from .response import Response
+from .role import Role
+
+# Decodes the value of an option payload, given the option and its interaction.
+OptionDecoder = Callable[[dict, Interaction], Any]
+
+SUB_COMMAND = 1
+SUB_COMMAND_GROUP = 2
+
+
+def _decode_member(option: dict, interaction: Interaction) -> Member:
+    return interaction.get_member(option["value"])
+
+
+def _decode_channel(option: dict, interaction: Interaction) -> Channel:
+    return interaction.get_channel(option["value"])
+
+
+def _decode_role(option: dict, interaction: Interaction) -> Role:
+    return interaction.get_role(option["value"])
+
+
+def _decode_mentionable(option: dict, interaction: Interaction) -> Union[Member, Role]:
+    if option["value"] in interaction.resolved.get("roles", ()):
+        return interaction.get_role(option["value"])
+    return interaction.get_member(option["value"])
+
+
+# The option type and decoder used for each type hint.
+OPTION_TYPES: dict[Any, tuple[int, OptionDecoder]] = {
+    str: (3, lambda option, interaction: str(option["value"])),
+    int: (4, lambda option, interaction: int(option["value"])),
+    bool: (5, lambda option, interaction: bool(option["value"])),
+    Member: (6, _decode_member),
+    Channel: (7, _decode_channel),
+    Role: (8, _decode_role),
+    Union[Member, Role]: (9, _decode_mentionable),
+    float: (10, lambda option, interaction: float(option["value"])),
+}
 
 
 class Handler(ABC):
@@ -22,54 +65,106 @@ class Handler(ABC):
     options: list[Option]
     guilds: list[int]
 
-    def __init__(self, name: str, description: str, _global: bool, guilds: list[int]):
+    def __init__(self, name: str, description: str, _global: bool, guilds: list[int],
+                 timeout: Optional[float] = None):
         self.name = name
         self.description = description
+        self.timeout = timeout
         self.options = []
         self._global = _global
         self.guilds = guilds
+        self.subcommands: dict[str, Handler] = {}
+
+        # Compiled from the function's signature when it is assigned, see `_create_options`.
+        self._decoders: dict[str, tuple[str, OptionDecoder]] = {}
+        self._defaults: dict[str, Any] = {}
+        self._required: frozenset[str] = frozenset()
+        self._argument_count = 0
 
     def __call__(self, func: Callable, *args, **kwargs) -> None:  # noQA: D102
         self.function = func
         self._create_options()
 
     def _create_options(self) -> None:
+        """
+        Create the options of the handler from the function's parameters.
+
+        This also compiles the table used to decode options at dispatch time, mapping each option
+        name to its parameter and decoder, so decoding never has to inspect the option's type.
+        """
         hints = get_type_hints(self.function)
+        # The first parameter is always the Interaction.
+        parameters = list(inspect.signature(self.function).parameters.values())[1:]
 
-        for name, hint in hints.items():
-            if hint is Interaction:
-                continue
+        required = set()
+        for parameter in parameters:
+            hint = hints.get(parameter.name, str)
+            default = parameter.default
 
-            if isinstance(hint, Option):
-                option = hint.default
+            if isinstance(default, Option):
+                option = default
                 if option.name is None:
-                    option.name = str(hint.name)
-                if option.description is None:
+                    option.name = parameter.name
+                if not option.description:
                     option.description = " "
+                default = None
             else:
-                option = Option(name=name, desc=" ")
-
-            if get_origin(hint) is Union and type(None) in get_args(
-                    hint):  # Check if the parameter is typed as Optional
+                option = Option(name=parameter.name, desc=" ")
+                if default is inspect.Parameter.empty:
+                    default = None
+                else:
+                    option.required = False
+
+            # Check if the parameter is typed as Optional
+            if get_origin(hint) is Union and type(None) in get_args(hint):
                 option.required = False
-                args = [arg for arg in get_args(hint) if arg != type(None)]
-                if len(args) > 1:
-                    raise TypeError(f"Cannot type hint parameter as: {', '.join(*args)}")
-                hint = args[0]
-
-            if hint is str:
-                option.type = 3
-            elif hint is int:
-                option.type = 4
-            elif hint is bool:
-                option.type = 5
-            elif hint is Member:
-                option.type = 6
-            else:
+                args = tuple(arg for arg in get_args(hint) if arg is not type(None))
+                hint = args[0] if len(args) == 1 else Union[args]
+
+            if hint not in OPTION_TYPES:
                 raise ValueError(f"Cannot convert parameter of type: {hint}")
+            option.type, decoder = OPTION_TYPES[hint]
 
+            self._decoders[option.name] = (parameter.name, decoder)
+            if option.required:
+                required.add(parameter.name)
+            else:
+                self._defaults[parameter.name] = default
             self.options.append(option)
 
+        self._required = frozenset(required)
+        self._argument_count = len(parameters)
+
+    def subcommand(self, name: str, description: str) -> Handler:
+        """
+        Create a subcommand of this handler.
+
+        Subcommands of a subcommand make it a subcommand group. A handler with
+        subcommands can only be used through them, its own function is never called.
+        """
+        handler = type(self)(name.lower(), description, self._global, self.guilds, self.timeout)
+        self.subcommands[handler.name] = handler
+        return handler
+
+    async def dispatch(self, interaction: Interaction, options: Optional[list[dict]]) -> Response:
+        """Call the handler's function, or the subcommand being used, with the decoded options."""
+        if self.subcommands:
+            option = options[0]
+            return await self.subcommands[option["name"]].dispatch(interaction, option.get("options"))
+
+        arguments = dict(self._defaults)
+        if options:
+            decoders = self._decoders
+            for option in options:
+                if (decoder := decoders.get(option["name"])) is not None:
+                    parameter, decode = decoder
+                    arguments[parameter] = decode(option, interaction)
+
+        if len(arguments) != self._argument_count:
+            raise MissingOptions(self.name, sorted(self._required - arguments.keys()))
+
+        return await self.function(interaction, **arguments)
+
     @abstractmethod
     async def handle(self, interaction: Interaction) -> Response:
         """Replaced with the Interaction Handler when added to a router."""
@@ -83,8 +178,19 @@ class Handler(ABC):
     @property
     def json(self) -> dict:
         """Return the json form off the Interaction Handler."""
+        if self.subcommands:
+            options = [
+                {
+                    **handler.json,
+                    "type": SUB_COMMAND_GROUP if handler.subcommands else SUB_COMMAND
+                }
+                for handler in self.subcommands.values()
+            ]
+        else:
+            options = [option.json for option in self.options]
+
         return {
             "name": self.name,
             "description": self.description,
-            "options": [option.json for option in self.options],
+            "options": options,
         }
@@ -1,4 +1,17 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Optional, TYPE_CHECKING
+
+from dispair.deadline import INTERACTION_TOKEN_LIFETIME
+from .channel import Channel
+from .fields import LazyInt
 from .member import Member
+from .role import Role
+
+if TYPE_CHECKING:
+    from dispair.member_cache import MemberCache
 
 
 class Interaction:
@@ -6,8 +19,22 @@ class Interaction:
     Discord Interaction.
 
     https://discord.com/developers/docs/interactions/slash-commands#interaction
+
+    Ids are kept as they were received and only parsed when they are first read.
     """
 
+    __slots__ = (
+        "_id", "_application_id", "_type", "_guild_id", "_channel_id",
+        "data", "member", "user", "token", "member_cache", "_author", "received_at", "deadline",
+        "acknowledged",
+    )
+
+    id = LazyInt("_id")
+    application_id = LazyInt("_application_id")
+    type = LazyInt("_type")
+    guild_id = LazyInt("_guild_id")
+    channel_id = LazyInt("_channel_id")
+
     def __init__(
             self,
             _id: int,
@@ -20,15 +47,46 @@ class Interaction:
             user: dict,
             token: str
     ):
-        self.id = int(_id)
-        self.application_id = int(application_id)
-        self.type = int(_type)
+        self._id = _id
+        self._application_id = application_id
+        self._type = _type
         self.data = data
-        self.guild_id = int(guild_id)
-        self.channel_id = int(channel_id)
+        self._guild_id = guild_id
+        self._channel_id = channel_id
         self.member = member
         self.user = user
         self.token = token
+        self.member_cache: Optional[MemberCache] = None
+        self._author: Optional[Member] = None
+        self.received_at = time.monotonic()
+        # Narrowed by the Client to what its transport and the handler's timeout allow.
+        self.deadline = self.received_at + INTERACTION_TOKEN_LIFETIME
+        # Set once the deferred response has been delivered, or failed to be, when the Interaction is deferred.
+        self.acknowledged: Optional[asyncio.Future] = None
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> Interaction:
+        """Create an Interaction from an interaction payload sent by the Gateway or a webhook."""
+        member = payload.get("member")
+        return cls(
+            _id=payload["id"],
+            application_id=payload["application_id"],
+            _type=payload["type"],
+            data=payload.get("data", {}),
+            guild_id=payload.get("guild_id"),
+            channel_id=payload.get("channel_id"),
+            member=member,
+            user=member["user"] if member else payload.get("user"),
+            token=payload["token"],
+        )
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.id}: {self.name}>"
+
+    @property
+    def remaining(self) -> float:
+        """Get the seconds left until the deadline to respond to the Interaction."""
+        return self.deadline - time.monotonic()
 
     @property
     def name(self) -> str:
@@ -38,4 +96,39 @@ class Interaction:
     @property
     def author(self) -> Member:
         """Get the author of Interaction."""
-        return Member(**self.member)
+        if self._author is None:
+            if self.member:
+                self._author = Member(guild_id=self.guild_id, **self.member)
+            else:
+                self._author = Member(self.user)
+        return self._author
+
+    @property
+    def resolved(self) -> dict:
+        """Get the users, members, roles and channels resolved by Discord for the options."""
+        return self.data.get("resolved", {})
+
+    def get_member(self, user_id: Any) -> Member:
+        """
+        Get a Member used in this interaction, without making any requests.
+
+        The Member is built from the resolved data when Discord included it, otherwise it is
+        taken from the member cache. If neither know the user, only the Member's id is set.
+        """
+        if user_id in self.resolved.get("users", ()):
+            member = Member.from_resolved(self.resolved, user_id, self.guild_id)
+            if self.member_cache is not None:
+                self.member_cache.put(member)
+            return member
+
+        if self.member_cache is not None and (member := self.member_cache.get(self.guild_id, int(user_id))):
+            return member
+        return Member({"id": user_id}, self.guild_id)
+
+    def get_role(self, role_id: Any) -> Role:
+        """Get a Role used in this interaction, from the resolved data if it is available."""
+        return Role(role_id, self.guild_id, **self.resolved.get("roles", {}).get(role_id, {}))
+
+    def get_channel(self, channel_id: Any) -> Channel:
+        """Get a Channel used in this interaction, from the resolved data if it is available."""
+        return Channel(channel_id, self.guild_id, **self.resolved.get("channels", {}).get(channel_id, {}))
@@ -1,5 +1,9 @@
 from __future__ import annotations
 
+from typing import Optional
+
+from .fields import LazyInt
+
 
 class Member:
     """
@@ -8,23 +12,69 @@ class Member:
     https://discord.com/developers/docs/resources/guild#guild-member-object
     """
 
-    id: int
-    username: str
-    discriminator: str
-    avatar: str
+    __slots__ = ("_user", "_member", "_id", "_roles", "guild_id")
+
+    id = LazyInt("_id")
+
+    def __init__(self, user: Optional[dict] = None, guild_id: Optional[int] = None, **member):
+        """Create a Member from a user object and the fields of a guild member object."""
+        self._user = user or {}
+        self._member = member
+        self._id = self._user.get("id")
+        self._roles: Optional[list[int]] = None
+        self.guild_id = guild_id
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.id}>"
+
+    @property
+    def username(self) -> Optional[str]:
+        """Get the Member's username."""
+        return self._user.get("username")
+
+    @property
+    def discriminator(self) -> Optional[str]:
+        """Get the Member's discriminator."""
+        return self._user.get("discriminator")
+
+    @property
+    def avatar(self) -> Optional[str]:
+        """Get the Member's avatar hash."""
+        return self._user.get("avatar")
+
+    @property
+    def nick(self) -> Optional[str]:
+        """Get the Member's nickname in the guild."""
+        return self._member.get("nick")
+
+    @property
+    def joined_at(self) -> Optional[str]:
+        """Get when the Member joined the guild."""
+        return self._member.get("joined_at")
 
-    def __init__(self, **kwargs):
-        print("Member ", kwargs)
+    @property
+    def roles(self) -> list[int]:
+        """Get the ids of the Member's roles."""
+        if self._roles is None:
+            self._roles = [int(role) for role in self._member.get("roles", ())]
+        return self._roles
 
     @property
     def mention(self) -> str:
         """Get the mention string for the Member."""
         return f"<@{self.id}>"
 
+    @property
+    def display_name(self) -> Optional[str]:
+        """Get the name shown for the Member in their guild."""
+        return self.nick or self.username
+
+    @classmethod
+    def from_resolved(cls, resolved: dict, user_id: str, guild_id: Optional[int] = None) -> Member:
+        """Create a Member from the resolved data of an interaction."""
+        return cls(resolved["users"][user_id], guild_id, **resolved.get("members", {}).get(user_id, {}))
+
     @classmethod
     async def from_userid(cls, guild_id: int, user_id: int) -> Member:
         """Fetch a Guild Member from ID."""
-        member = cls()
-        member.id = user_id
-        member.guild = guild_id
-        return member
+        return cls({"id": user_id}, guild_id)
@@ -5,10 +5,7 @@ class Option:
     https://discord.com/developers/docs/interactions/slash-commands#applicationcommandoption
     """
 
-    name: str
-    description: str
-    type: int
-    required: bool
+    __slots__ = ("name", "description", "type", "required")
 
     def __init__(
             self,
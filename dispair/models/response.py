@@ -1,5 +1,8 @@
+from __future__ import annotations
+
 from typing import Optional
 
+from dispair.codec import JsonCodec, STDLIB
 from dispair.utils import Embed
 
 
@@ -10,11 +13,14 @@ class Response:
     This contains the text content, embeds and mention permissions.
     """
 
+    __slots__ = ("content", "embeds", "_encoded")
+
     def __init__(self, content: str = "", *, embed: Optional[Embed] = None):
         self.content = content
         self.embeds = []
         if embed:
             self.embeds.append(embed)
+        self._encoded: Optional[bytes] = None
 
     def json(self) -> dict:
         """Return the json representation of the Response."""
@@ -22,8 +28,48 @@ class Response:
             "type": 4,
             "data": {
                 "tts": False,
-                "content": self.content,
-                "embeds": [embed.json() for embed in self.embeds],
-                "allowed_mentions": {"parse": []}
+                **self.message(),
             }
         }
+
+    def message(self) -> dict:
+        """Return the json representation of the Response's message, used to edit a deferred response."""
+        return {
+            "content": self.content,
+            "embeds": [embed.json() for embed in self.embeds],
+            "allowed_mentions": {"parse": []}
+        }
+
+    def encode(self, codec: JsonCodec = STDLIB) -> bytes:
+        """Return the Response encoded as the json body of an interaction callback."""
+        if self._encoded is not None:
+            return self._encoded
+        return codec.dumps(self.json())
+
+    def freeze(self, codec: JsonCodec = STDLIB) -> Response:
+        """
+        Encode the Response once and reuse the bytes every time it is sent.
+
+        This is meant for constant responses, such as module level replies with fixed embeds.
+        Changes made to a frozen Response are not sent.
+        """
+        self._encoded = codec.dumps(self.json())
+        return self
+
+    @property
+    def frozen(self) -> bool:
+        """Get if the Response has been frozen."""
+        return self._encoded is not None
+
+
+class DeferredResponse(Response):
+    """Acknowledge an interaction, the response is sent later by editing the original message."""
+
+    __slots__ = ()
+
+    def json(self) -> dict:
+        """Return the json representation of the DeferredResponse."""
+        return {"type": 5}
+
+
+DEFERRED = DeferredResponse().freeze()
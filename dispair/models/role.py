@@ -0,0 +1,24 @@
+class Role:
+    """
+    Discord Guild Role.
+
+    https://discord.com/developers/docs/topics/permissions#role-object
+    """
+
+    __slots__ = ("id", "guild_id", "name", "color", "position", "permissions")
+
+    def __init__(self, _id: int, guild_id: int, **data):
+        self.id = int(_id)
+        self.guild_id = guild_id
+        self.name = data.get("name")
+        self.color = data.get("color", 0)
+        self.position = data.get("position", 0)
+        self.permissions = data.get("permissions")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.id}>"
+
+    @property
+    def mention(self) -> str:
+        """Get the mention string for the Role."""
+        return f"<@&{self.id}>"
@@ -2,7 +2,6 @@ from typing import Optional
 
 from dispair.models.handler import Handler
 from dispair.models.interaction import Interaction
-from dispair.models.member import Member
 from dispair.models.response import Response
 
 
@@ -17,8 +16,13 @@ class Router:
         return self.interaction(*args, **kwargs)
 
     def interaction(self, name: str, description: str, *, _global: bool = True,
-                    guilds: Optional[list[int]] = None) -> Handler:
-        """Create a Interaction Handler."""
+                    guilds: Optional[list[int]] = None, timeout: Optional[float] = None) -> Handler:
+        """
+        Create a Interaction Handler.
+
+        Handlers that run for longer than `timeout` seconds are cancelled and the
+        Client's timeout response is sent instead.
+        """
         if guilds is None:
             guilds = []
 
@@ -27,26 +31,14 @@ class Router:
         class Handle(Handler):
             async def handle(self, interaction: Interaction) -> Response:
                 """Overwrite the handle method with handler's function object."""
-                options = {}
-
-                if data_options := interaction.data.get("options"):
-                    for option in data_options:
-                        if option["type"] == 3:
-                            options[option["name"]] = str(option["value"])
-                        elif option["type"] == 4:
-                            options[option["name"]] = int(option["value"])
-                        elif option["type"] == 5:
-                            options[option["name"]] = bool(option["value"])
-                        elif option["type"] == 6:
-                            options[option["name"]] = await Member.from_userid(interaction.guild_id, option["value"])
-
-                return await self.function(interaction, **options)
+                return await self.dispatch(interaction, interaction.data.get("options"))
 
         handler = Handle(
             name,
             description,
             _global,
-            guilds
+            guilds,
+            timeout
         )
         self.handlers[name] = handler
         return handler
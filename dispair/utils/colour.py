@@ -4,6 +4,8 @@ from __future__ import annotations
 class Colour:
     """Colour Utility to handle decimal, hex and rgb."""
 
+    __slots__ = ("r", "g", "b")
+
     def __init__(self, r: int, g: int, b: int):
         self.r = r
         self.g = g
@@ -1,4 +1,3 @@
-from datetime import datetime
 from typing import Optional
 
 from dispair.utils.colour import Colour
@@ -11,18 +10,7 @@ class Embed:
     https://discord.com/developers/docs/resources/channel#embed-object
     """
 
-    title: str
-    description: str
-    url: str
-    timestamp: datetime
-    color: Colour
-    footer: dict
-    image: dict
-    thumbnail: dict
-    video: dict
-    provider: dict
-    author: dict
-    fields: list[dict]
+    __slots__ = ("title", "description", "color")
 
     def __init__(self, title: str, description: Optional[str] = None, colour: Optional[Colour] = None):
         self.title = title
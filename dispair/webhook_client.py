@@ -1,4 +1,7 @@
-from json import dumps
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from aiohttp import web
 from aiohttp.web_request import Request
@@ -6,24 +9,76 @@ from nacl.exceptions import BadSignatureError
 from nacl.signing import VerifyKey
 
 from .client import Client
-from .models import Response, Interaction
-from .router import Router
-from .utils import Embed
+from .models import Interaction
+
+
+# Reply to Discord's endpoint verification PING.
+PONG = b'{"type":1}'
 
 
 class WebhookClient(Client):
     """Client for webhook usage."""
 
     def __init__(self, bot_token: str, application_id: str, application_public_key: str,
-                 interaction_endpoint: str = "/interactions", port: int = 80):
-        super().__init__(bot_token)
+                 interaction_endpoint: str = "/interactions", port: int = 80, *, verify_threads: int = 0,
+                 **kwargs):
+        """
+        Create a WebhookClient.
+
+        When `verify_threads` is set, request signatures are verified in a pool of that many
+        threads instead of on the event loop. PyNaCl releases the GIL while verifying.
+        """
+        super().__init__(bot_token, application_id, **kwargs)
         self._app = web.Application()
-        self._routers: list[Router] = []
         self._pub_key = application_public_key
         self.interaction_endpoint = interaction_endpoint
         assert self.interaction_endpoint[0] == "/", "Interaction Endpoint must begin with /"
         self.port = port
         self.application_id = application_id
+        self.verify_threads = verify_threads
+        self._verify_key = VerifyKey(bytes.fromhex(application_public_key))
+        self._verify_executor: Optional[ThreadPoolExecutor] = None
+        self._stopped: Optional[asyncio.Event] = None
+
+    def _verify(self, message: bytes, signature: bytes) -> bool:
+        try:
+            self._verify_key.verify(message, signature)
+        except BadSignatureError:
+            return False
+        return True
+
+    async def _verify_request(self, timestamp: str, body: bytes, ed25519: str) -> bool:
+        """Check the request was signed by Discord, in the verify thread pool if there is one."""
+        try:
+            signature = bytes.fromhex(ed25519)
+        except ValueError:
+            return False
+
+        message = timestamp.encode() + body
+        if self.verify_threads <= 0:
+            return self._verify(message, signature)
+
+        if self._verify_executor is None:
+            self._verify_executor = ThreadPoolExecutor(self.verify_threads, thread_name_prefix="dispair-verify")
+        return await asyncio.get_running_loop().run_in_executor(self._verify_executor, self._verify, message, signature)
+
+    async def process(self, timestamp: str, ed25519: str, body: bytes) -> Optional[tuple[bytes, Optional[Interaction]]]:
+        """
+        Process a request to the interaction endpoint, independent of the server it arrived through.
+
+        The body is verified and decoded from the same bytes. This returns the json body of the
+        reply and the Interaction it responds to, or None if the request was not signed by Discord.
+        Once the reply has been sent, the server must call `_acknowledge` with the Interaction.
+        """
+        if not await self._verify_request(timestamp, body, ed25519):
+            return None
+
+        payload = self.json_codec.loads(body)
+        if payload.get('type') == 1:
+            return PONG, None
+        interaction = Interaction.from_payload(payload)
+        response = await self.respond(interaction)
+        return response.encode(self.json_codec), interaction
 
     async def _interaction(self, request: Request) -> web.Response:
         """Aiohttp endpoint handler for DiscordInteractions."""
@@ -31,47 +86,75 @@ class WebhookClient(Client):
                 or (ed25519 := request.headers.get("X-Signature-Ed25519")) is None:
             return web.Response(status=401, reason="Unauthorised")
 
-        try:
-            self._verify_key.verify((timestamp + await request.text()).encode(), bytes.fromhex(ed25519))
-        except BadSignatureError:
+        if (reply := await self.process(timestamp, ed25519, await request.read())) is None:
             return web.Response(status=401, reason="Unauthorised")
 
-        payload = await request.json()
-        if payload.get('type') == 1:
-            return web.Response(status=200, text=dumps({"type": 1}), content_type="application/json")
-        else:
-            response = await self._handle(payload)
-            return web.Response(status=200, text=response.json(), content_type="application/json")
-
-    async def _handle(self, payload: dict) -> Response:
-        interaction = Interaction(
-            _id=payload.get("id"),
-            application_id=payload.get("application_id"),
-            _type=payload.get("type"),
-            data=payload.get("data"),
-            guild_id=payload.get("guild_id"),
-            channel_id=payload.get("channel_id"),
-            member=payload.get("member"),
-            user=payload.get("user"),
-            token=payload.get("token"),
-        )
-        router = self._routers[0]
-        handler = router.handlers.get(interaction.name)
-        response = await handler.handle(interaction)
-        if isinstance(response, Response):
-            return response
-        elif isinstance(response, (int, str)):
-            return Response(content=str(response))
-        elif isinstance(response, Embed):
-            return Response(embed=response)
-        else:
+        body, interaction = reply
+        response = web.Response(status=200, body=body, content_type="application/json")
+        if interaction is not None and interaction.acknowledged is not None:
+            # Send the deferred response now, so the follow-up knows it has been delivered.
             try:
-                return Response(content=str(response))
-            except ValueError:
-                raise ValueError(f"Cannot send type {response} as a Interaction response.")
+                await response.prepare(request)
+                await response.write_eof()
+            except Exception:
+                self._acknowledge(interaction, False)
+                raise
+            self._acknowledge(interaction)
+        return response
 
-    def run(self) -> None:
-        """Start the Dispair client."""
-        self._verify_key = VerifyKey(bytes.fromhex(self._pub_key))
+    async def shutdown(self) -> None:
+        """Shutdown the bot, closing any resources being currently used."""
+        if self._verify_executor is not None:
+            self._verify_executor.shutdown(wait=False)
+            self._verify_executor = None
+        await super().shutdown()
+
+    async def _serve(self, sock: Optional[socket.socket] = None, *, reuse_port: bool = False) -> None:
+        """Serve the interaction endpoint on this process's event loop until it is stopped."""
+        runner = web.AppRunner(self._app)
+        await runner.setup()
+        if sock is not None:
+            site = web.SockSite(runner, sock)
+        else:
+            site = web.TCPSite(runner, port=self.port, reuse_port=reuse_port)
+        await site.start()
+        self._logger.info(f"Serving {self.interaction_endpoint} on port {self.port}")
+
+        self._stopped = asyncio.Event()
+        try:
+            await self._stopped.wait()
+        finally:
+            await runner.cleanup()
+            await self.shutdown()
+
+    def stop(self) -> None:
+        """Stop serving the interaction endpoint, this can be called from any thread."""
+        if self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def run(self, workers: int = 1, *, reuse_port: bool = False) -> None:
+        """
+        Start the Dispair client.
+
+        With more than one worker the endpoint is served by that many forked processes, which are
+        restarted if they die. The workers accept connections from one socket bound before forking,
+        or when `reuse_port` is set, each worker binds the port itself with SO_REUSEPORT and the
+        kernel balances connections between them. Commands are only synced once, before forking.
+        """
+        super().run()
         self._app.add_routes((web.post(self.interaction_endpoint, self._interaction),))
-        web.run_app(self._app, port=self.port)
+
+        if workers <= 1:
+            # Served on the client's loop, which its HttpSession and background tasks belong to.
+            try:
+                self._loop.run_until_complete(self._serve())
+            except KeyboardInterrupt:
+                pass
+            return
+
+        sock = None if reuse_port else socket.create_server(("", self.port))
+        try:
+            self._run_workers(workers, lambda index: self._serve(sock, reuse_port=reuse_port))
+        finally:
+            if sock is not None:
+                sock.close()
@@ -0,0 +1,62 @@
+import logging
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Callable
+
+
+class WorkerPool:
+    """
+    Run a target in several forked worker processes.
+
+    The target is called with the index of the worker. Workers that die are restarted,
+    workers that exit cleanly are left stopped. This blocks until every worker has stopped.
+    """
+
+    def __init__(self, target: Callable[[int], None], workers: int, *, restart_delay: float = 1):
+        assert workers > 0, "A WorkerPool requires at least one worker"
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self._context = multiprocessing.get_context("fork")
+        self._processes: dict[int, BaseProcess] = {}
+        self._logger = logging.getLogger("WorkerPool")
+
+    def _start(self, index: int) -> None:
+        process = self._context.Process(target=self.target, args=(index,), name=f"dispair-worker-{index}")
+        process.start()
+        self._processes[index] = process
+        self._logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def run(self) -> None:
+        """Start the workers and supervise them, restarting any that die."""
+        for index in range(self.workers):
+            self._start(index)
+
+        try:
+            while self._processes:
+                sentinels = {process.sentinel: index for index, process in self._processes.items()}
+                for sentinel in wait(list(sentinels)):
+                    index = sentinels[sentinel]
+                    process = self._processes.pop(index)
+                    process.join()
+                    if process.exitcode == 0:
+                        self._logger.info(f"Worker {index} stopped")
+                        continue
+
+                    self._logger.error(f"Worker {index} died with exit code {process.exitcode}, restarting")
+                    time.sleep(self.restart_delay)
+                    self._start(index)
+        except KeyboardInterrupt:
+            self._logger.info("Stopping workers")
+        finally:
+            self.terminate()
+
+    def terminate(self) -> None:
+        """Terminate every running worker."""
+        for process in self._processes.values():
+            process.terminate()
+        for process in self._processes.values():
+            process.join()
+        self._processes.clear()
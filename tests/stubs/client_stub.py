@@ -31,3 +31,6 @@ class ClientStub(Client):
 
     async def _register_handler(self, *args, **kwargs):
         ...
+
+    async def _sync_guild_commands(self, *args, **kwargs):
+        ...
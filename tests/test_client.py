@@ -1,7 +1,14 @@
+import asyncio
 from json import loads
+from typing import Optional
+
 import pytest
-from dispair import Router
-from dispair.models import Interaction, Option, Response
+from dispair import deadline, Router
+from dispair.dispatch_table import DispatchTable
+from dispair.exceptions import MissingOptions
+from dispair.http.http_session import ApiPath
+from dispair.member_cache import MemberCache
+from dispair.models import Interaction, Member, Option, Response, Role
 
 from stubs.client_stub import ClientStub
 
@@ -187,3 +194,318 @@ async def test_router_bool_parameter(client: ClientStub):
 
     resp: Response = await client.msg_out.get()
     assert resp.json()["data"]["content"] == str(bool_val) and resp.json()["type"] == 4
+
+
+@pytest.mark.asyncio
+async def test_unknown_guild_reconciled_in_background(client: ClientStub):
+    router = Router()
+    reconciled = asyncio.Event()
+    release = asyncio.Event()
+
+    async def sync_guild_commands(guild: int):
+        await release.wait()
+        reconciled.set()
+
+    client._sync_guild_commands = sync_guild_commands
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        return "> Dispatched"
+
+    client.attach_router(router)
+
+    await client.msg_in.put(
+        Interaction(
+            _id=1,
+            application_id=1,
+            _type=2,
+            data={"id": 123, "name": "test"},
+            guild_id=5,
+            channel_id=1,
+            member={},
+            user={},
+            token=""
+        )
+    )
+
+    resp: Response = await client.msg_out.get()
+    assert resp.json()["data"]["content"] == "> Dispatched"
+    assert 5 in client._known_guilds and not reconciled.is_set()
+
+    release.set()
+    await client._reconcile_queue.join()
+    assert reconciled.is_set()
+
+
+def test_dispatch_table():
+    router = Router()
+
+    @router.interaction("everywhere", "Global command")
+    async def everywhere(inter: Interaction):
+        ...
+
+    @router.interaction("local", "Guild command", _global=False, guilds=[1])
+    async def local(inter: Interaction):
+        ...
+
+    table = DispatchTable.compile([router])
+    assert table.get(1, "local") is router.handlers["local"]
+    assert table.get(1, "everywhere") is router.handlers["everywhere"]
+    assert table.get(2, "everywhere") is router.handlers["everywhere"]
+    assert table.get(2, "local") is None
+    assert table.get(None, "missing") is None
+
+
+def make_interaction(options: list[dict]) -> Interaction:
+    return Interaction(
+        _id=1,
+        application_id=1,
+        _type=2,
+        data={"id": 123, "name": "test", "options": options},
+        guild_id=1,
+        channel_id=1,
+        member={},
+        user={},
+        token=""
+    )
+
+
+@pytest.mark.asyncio
+async def test_handler_option_defaults():
+    router = Router()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction, number: float, text: Optional[str] = Option(desc="Text"),
+                           count: int = 3):
+        return number, text, count
+
+    handler = router.handlers["test"]
+    assert [option.json["required"] for option in handler.options] == [True, False, False]
+    assert [option.json["type"] for option in handler.options] == [10, 3, 4]
+
+    assert await handler.handle(make_interaction([{"name": "number", "value": 1.5, "type": 10}])) == (1.5, None, 3)
+
+    with pytest.raises(MissingOptions):
+        await handler.handle(make_interaction([{"name": "count", "value": 1, "type": 4}]))
+
+
+@pytest.mark.asyncio
+async def test_handler_subcommands():
+    router = Router()
+    settings = router.interaction("test", "Settings")
+
+    @settings.subcommand("show", "Show a setting")
+    async def show(inter: Interaction, key: str):
+        return f"show {key}"
+
+    roles = settings.subcommand("roles", "Role settings")
+
+    @roles.subcommand("add", "Add a role")
+    async def add(inter: Interaction, role: Role):
+        return role
+
+    handler = router.handlers["test"]
+    assert [option["type"] for option in handler.json["options"]] == [1, 2]
+
+    show_options = [{"name": "show", "type": 1, "options": [{"name": "key", "value": "colour", "type": 3}]}]
+    assert await handler.handle(make_interaction(show_options)) == "show colour"
+
+    add_options = [{"name": "roles", "type": 2, "options": [
+        {"name": "add", "type": 1, "options": [{"name": "role", "value": "7", "type": 8}]}
+    ]}]
+    role = await handler.handle(make_interaction(add_options))
+    assert isinstance(role, Role) and role.id == 7
+
+
+@pytest.mark.asyncio
+async def test_member_options_resolved():
+    router = Router()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction, member: Member, other: Member):
+        return member, other
+
+    cache = MemberCache(max_size=2)
+    cache.put(Member({"id": "9", "username": "cached"}, 1))
+
+    interaction = make_interaction([
+        {"name": "member", "value": "5", "type": 6},
+        {"name": "other", "value": "9", "type": 6},
+    ])
+    interaction.data["resolved"] = {
+        "users": {"5": {"id": "5", "username": "resolved"}},
+        "members": {"5": {"nick": "nick", "roles": ["3"]}},
+    }
+    interaction.member_cache = cache
+
+    member, other = await router.handlers["test"].handle(interaction)
+    assert (member.id, member.display_name, member.roles, member.guild_id) == (5, "nick", [3], 1)
+    assert other.username == "cached"
+    assert cache.get(1, 5) is member
+
+    cache.put(Member({"id": "10"}, 1))
+    assert len(cache) == 2 and cache.get(1, 9) is None
+
+
+@pytest.mark.asyncio
+async def test_interaction_from_payload(client: ClientStub):
+    router = Router()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        return f"> {inter.author.username}"
+
+    client.attach_router(router)
+    interaction = Interaction.from_payload({
+        "id": "11", "application_id": "12", "type": 2, "token": "abc",
+        "data": {"name": "test"}, "channel_id": "13",
+        "user": {"id": "14", "username": "user"},
+    })
+    assert interaction._id == "11"
+    assert (interaction.id, interaction.guild_id, interaction.channel_id) == (11, None, 13)
+    assert interaction._id == 11
+    assert interaction.author is interaction.author and interaction.author.id == 14
+    assert not hasattr(interaction, "__dict__")
+
+    # DM interactions are handled without discovering a guild.
+    response = await client.handle(interaction)
+    assert response.content == "> user"
+    assert None not in client._known_guilds and client._reconcile_queue is None
+
+
+@pytest.mark.asyncio
+async def test_missing_handler_response_frozen(client: ClientStub):
+    interaction = make_interaction([])
+    response = await client.handle(interaction)
+    assert response.frozen and response is await client.handle(make_interaction([]))
+    assert loads(response.encode()) == response.json()
+
+    response.content = "changed"
+    assert loads(response.encode())["data"]["content"] == "> Command test is not supported"
+
+
+@pytest.mark.asyncio
+async def test_slow_handler_deferred(client: ClientStub):
+    router = Router()
+    finish = asyncio.Event()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        await finish.wait()
+        return "> done"
+
+    client.attach_router(router)
+    client.defer_after = 0.01
+    requests = []
+
+    async def request(method, path, **kwargs):
+        requests.append((method, path.path, kwargs["json"]))
+
+    client._http_session.request = request
+
+    interaction = make_interaction([])
+    interaction.token = "abc"
+    response = await client.respond(interaction)
+    assert response.json() == {"type": 5} and not requests
+
+    # The original response is only edited once the transport has delivered the deferred response.
+    finish.set()
+    await asyncio.sleep(0.01)
+    assert not requests
+
+    client._acknowledge(interaction)
+    await asyncio.gather(*client._followups)
+    assert requests == [("PATCH", "/webhooks//abc/messages/@original", Response("> done").message())]
+
+
+@pytest.mark.asyncio
+async def test_shutdown_cancels_deferred_handlers(client: ClientStub):
+    router = Router()
+    cancelled = asyncio.Event()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    client.attach_router(router)
+    client.defer_after = 0.01
+    client.shutdown_grace = 0.05
+    assert (await client.respond(make_interaction([]))).json() == {"type": 5}
+
+    await asyncio.wait_for(client.shutdown(), 1)
+    assert cancelled.is_set() and not client._followups
+
+
+@pytest.mark.asyncio
+async def test_deadline_from_transport(client: ClientStub):
+    router = Router()
+    remaining = []
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        remaining.append(deadline.remaining())
+        return "> done"
+
+    client.attach_router(router)
+    client.defer_after = None
+    await client.handle(make_interaction([]))
+    assert 0 < remaining[-1] <= deadline.INITIAL_RESPONSE_WINDOW
+
+    # A deferred response can be followed up until the token expires.
+    client.defer_after = 2.5
+    await client.handle(make_interaction([]))
+    assert deadline.INITIAL_RESPONSE_WINDOW < remaining[-1] <= deadline.INTERACTION_TOKEN_LIFETIME
+
+
+@pytest.mark.asyncio
+async def test_handler_cancelled_at_deadline(client: ClientStub):
+    router = Router()
+    cancelled = asyncio.Event()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    client.attach_router(router)
+    client.defer_after = None
+    interaction = make_interaction([])
+    # The initial response window has almost passed when the interaction is handled.
+    interaction.received_at -= deadline.INITIAL_RESPONSE_WINDOW - 0.05
+    assert await client.respond(interaction) is client.timeout_response
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_handler_timeout(client: ClientStub):
+    router = Router()
+    cancelled = asyncio.Event()
+    remaining = []
+
+    @router.interaction("test", "Test command", timeout=0.05)
+    async def test_command(inter: Interaction):
+        remaining.append(deadline.remaining())
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    client.attach_router(router)
+    assert await client.handle(make_interaction([])) is client.timeout_response
+    assert cancelled.is_set() and 0 < remaining[0] <= 0.05
+    assert deadline.remaining() is None
+
+    token = deadline.current_deadline.set(0)
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await client._http_session.request("GET", ApiPath("/gateway"))
+    finally:
+        deadline.current_deadline.reset(token)
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import zlib
+
+import pytest
+from aiohttp import WSMessage, WSMsgType
+from dispair import GatewayClient, Router
+from dispair.constants import Intents
+from dispair.gateway import Shard, ShardManager, etf
+from dispair.gateway.compression import ZlibStreamDecompressor
+from dispair.models import Interaction
+
+
+def make_interaction(name: str, guild_id: int = 1) -> Interaction:
+    return Interaction(
+        _id=1,
+        application_id=1,
+        _type=2,
+        data={"id": 123, "name": name},
+        guild_id=guild_id,
+        channel_id=1,
+        member={},
+        user={},
+        token=""
+    )
+
+
+@pytest.fixture(scope="function")
+async def client() -> GatewayClient:
+    client = GatewayClient("", "", max_in_flight=2)
+    client._known_guilds.add(1)
+    client.sent = []
+
+    async def request(method, path, **kwargs):
+        client.sent.append(json.loads(kwargs["data"]))
+
+    client._http_session.request = request
+    yield client
+    await client.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_interactions_dispatched_concurrently(client: GatewayClient):
+    router = Router()
+    release = asyncio.Event()
+    started = 0
+
+    @router.interaction("slow", "Slow command")
+    async def slow(inter: Interaction):
+        nonlocal started
+        started += 1
+        await release.wait()
+        return "done"
+
+    client.attach_router(router)
+
+    await client._schedule_interaction(make_interaction("slow"))
+    await client._schedule_interaction(make_interaction("slow"))
+    # Each handler runs in its own task, started by the dispatch task and bounded by wait_for.
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert started == 2 and len(client._in_flight) == 2
+
+    release.set()
+    await client._drain_in_flight()
+    assert len(client.sent) == 2 and not client._in_flight
+
+
+@pytest.mark.asyncio
+async def test_deferred_follow_up_after_callback(client: GatewayClient):
+    router = Router()
+    events = []
+
+    @router.interaction("slow", "Slow command")
+    async def slow(inter: Interaction):
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def request(method, path, **kwargs):
+        events.append(f"{method} start")
+        if method == "POST":
+            # The handler finishes while the deferred response is still in flight.
+            await asyncio.sleep(0.05)
+        events.append(f"{method} end")
+
+    client.attach_router(router)
+    client.defer_after = 0.01
+    client._http_session.request = request
+
+    await client._dispatch_interaction(make_interaction("slow"))
+    await asyncio.gather(*client._followups)
+    assert events == ["POST start", "POST end", "PATCH start", "PATCH end"]
+
+
+class WebsocketStub:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send_str(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=None):
+        self.closed = True
+
+
+@pytest.fixture(scope="function")
+def shard(client: GatewayClient) -> Shard:
+    shard = Shard(client, 0, 1)
+    shard._ws_session = WebsocketStub()
+    client._shards[0] = shard
+    return shard
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_sequence_and_latency(client: GatewayClient, shard: Shard):
+    await shard._handle_payload({"op": 0, "s": 5, "t": "MESSAGE_CREATE", "d": {}})
+    await shard._handle_payload({"op": 1, "d": None})
+    assert shard._ws_session.sent[-1] == {"op": 1, "d": 5}
+    assert shard.latency is None and client.latency is None
+
+    await shard._handle_payload({"op": 11})
+    assert shard._heartbeat_acked and len(shard.latencies) == 1
+    assert shard.latency == shard.latencies[0] == client.latencies[0]
+
+
+@pytest.mark.asyncio
+async def test_ready_session_is_resumed(shard: Shard):
+    assert not shard.can_resume
+
+    await shard._handle_payload({
+        "op": 0, "s": 1, "t": "READY",
+        "d": {"session_id": "abc", "resume_gateway_url": "wss://resume.discord.gg", "guilds": []}
+    })
+    await shard._handle_payload({"op": 0, "s": 2, "t": "MESSAGE_CREATE", "d": {}})
+    assert shard.can_resume
+
+    await shard._resume()
+    assert shard._ws_session.sent[-1] == {"op": 6, "d": {"token": "", "session_id": "abc", "seq": 2}}
+
+    shard._invalidate_session()
+    assert not shard.can_resume
+
+
+@pytest.mark.asyncio
+async def test_identify_with_shard(client: GatewayClient):
+    client.session_start_limit = {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}
+    shard = Shard(client, 3, 8)
+    shard._ws_session = WebsocketStub()
+
+    await shard._identify()
+    assert shard._ws_session.sent[-1]["d"]["shard"] == [3, 8]
+    assert client.session_start_limit["remaining"] == 999
+
+
+@pytest.mark.asyncio
+async def test_shard_manager_assignment(client: GatewayClient):
+    client.shards = 8
+    client.max_concurrency = 2
+    manager = ShardManager(client, 3)
+
+    assert manager.assignments == [[0, 3, 6], [1, 4, 7], [2, 5]]
+    assert manager.start_delays == {0: 0, 1: 0, 2: 5, 3: 5, 4: 10, 5: 10, 6: 15, 7: 15}
+
+
+def test_zlib_stream_decompressor():
+    compressor = zlib.compressobj()
+    decompressor = ZlibStreamDecompressor()
+    payloads = [{"op": 10, "d": {"heartbeat_interval": 41250}}, {"op": 11}, {"op": 0, "t": "READY", "d": {}}]
+
+    for payload in payloads:
+        data = compressor.compress(json.dumps(payload).encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        # Send the message over two frames, the first frame alone is not a complete message.
+        assert decompressor.feed(data[:3]) is None
+        assert json.loads(decompressor.feed(data[3:])) == payload
+
+
+def test_etf_decode():
+    # term_to_binary(#{op => 11, d => nil, t => 'READY', s => [1, 2]}) as sent by Erlang
+    data = bytes([
+        131, 116, 0, 0, 0, 4,
+        100, 0, 2, 111, 112, 97, 11,
+        100, 0, 1, 100, 100, 0, 3, 110, 105, 108,
+        100, 0, 1, 116, 100, 0, 5, 82, 69, 65, 68, 89,
+        100, 0, 1, 115, 107, 0, 2, 1, 2,
+    ])
+    assert etf.decode(data) == {"op": 11, "d": None, "t": "READY", "s": [1, 2]}
+
+
+def test_etf_round_trip():
+    payload = {
+        "op": 0,
+        "t": "INTERACTION_CREATE",
+        "s": 70000,
+        "d": {
+            "id": 846462639134605312,
+            "token": "aW50ZXJhY3Rpb24",
+            "negative": -5,
+            "ratio": 0.5,
+            "options": [{"name": "param", "value": True}],
+            "empty": [],
+            "resolved": None,
+        },
+    }
+    assert etf.decode(etf.encode(payload)) == payload
+
+
+@pytest.mark.asyncio
+async def test_intents_derived_from_listeners():
+    client = GatewayClient("", "", track_guilds=False)
+    assert client.intents == Intents.NONE
+
+    @client.listen("guild_member_add")
+    async def member_added(data: dict):
+        ...
+
+    assert client.intents == Intents.GUILD_MEMBERS
+
+    client._intents = 513
+    assert client.intents == Intents.GUILDS | Intents.GUILD_MESSAGES
+    await client.shutdown()
+
+
+@pytest.mark.parametrize("encoding", ["json", "etf"])
+def test_unsubscribed_events_are_not_decoded(shard: Shard, encoding: str):
+    shard.encoding = encoding
+    encode = etf.encode if encoding == "etf" else json.dumps
+    msg_type = WSMsgType.BINARY if encoding == "etf" else WSMsgType.TEXT
+
+    message = {"t": "MESSAGE_CREATE", "s": 42, "op": 0, "d": {"content": "Not interesting"}}
+    assert shard._decode(WSMessage(msg_type, encode(message), None)) is None
+    assert shard._sequence == 42
+
+    interaction = {"t": "INTERACTION_CREATE", "s": 43, "op": 0, "d": {"id": 1}}
+    assert shard._decode(WSMessage(msg_type, encode(interaction), None)) == interaction
+
+
+@pytest.mark.asyncio
+async def test_guilds_tracked_from_events(client: GatewayClient, shard: Shard):
+    synced = []
+
+    async def sync_guild_commands(guild: int):
+        synced.append(guild)
+
+    client._sync_guild_commands = sync_guild_commands
+    assert client.intents == Intents.GUILDS
+
+    await shard._handle_payload({
+        "op": 0, "s": 1, "t": "READY",
+        "d": {"session_id": "abc", "resume_gateway_url": "", "guilds": [{"id": "2", "unavailable": True}]}
+    })
+    await shard._handle_payload({"op": 0, "s": 2, "t": "GUILD_CREATE", "d": {"id": "2"}})
+    await shard._handle_payload({"op": 0, "s": 3, "t": "GUILD_CREATE", "d": {"id": "3"}})
+    await client._reconcile_queue.join()
+    assert client._known_guilds == {1, 2, 3} and synced == [2, 3]
+
+    await shard._handle_payload({"op": 0, "s": 4, "t": "GUILD_DELETE", "d": {"id": "2", "unavailable": True}})
+    await shard._handle_payload({"op": 0, "s": 5, "t": "GUILD_DELETE", "d": {"id": "3"}})
+    assert client._known_guilds == {1, 2}
+
+    # Guild events only reach listeners when guilds are not tracked.
+    client.track_guilds = False
+    await shard._handle_payload({"op": 0, "s": 6, "t": "GUILD_CREATE", "d": {"id": "4"}})
+    await shard._handle_payload({"op": 0, "s": 7, "t": "GUILD_DELETE", "d": {"id": "2"}})
+    assert client._known_guilds == {1, 2} and client._reconcile_queue.empty()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("codec", ["stdlib", "orjson"])
+async def test_json_codec(codec: str):
+    if codec == "orjson":
+        pytest.importorskip("orjson")
+    client = GatewayClient("", "", json_codec=codec)
+    assert client.json_codec.name == codec and client._http_session.codec is client.json_codec
+
+    shard = Shard(client, 0, 1)
+    payload = {"t": "INTERACTION_CREATE", "s": 1, "op": 0, "d": {"id": "1"}}
+    encoded = client.json_codec.dumps(payload)
+    assert isinstance(encoded, bytes)
+    assert shard._decode(WSMessage(WSMsgType.BINARY, encoded, None)) == payload
+    assert shard._decode(WSMessage(WSMsgType.TEXT, encoded.decode(), None)) == payload
+    await client._http_session.kill()
+
+
+class StopShard(BaseException):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_shard_survives_unexpected_errors(shard: Shard):
+    errors = [etf.ETFDecodeError("bad frame"), KeyError("d"), StopShard()]
+    attempts = 0
+
+    async def connect_to_gateway():
+        shard._ws_session = WebsocketStub()
+
+    async def handle_loop():
+        nonlocal attempts
+        attempts += 1
+        raise errors.pop(0)
+
+    shard.max_backoff = 0.01
+    shard.connect_to_gateway = connect_to_gateway
+    shard.handle_loop = handle_loop
+    with pytest.raises(StopShard):
+        await shard.run()
+    assert attempts == 3
+
+
+@pytest.mark.asyncio
+async def test_handshake_without_hello_reconnects(shard: Shard):
+    async def receive():
+        return WSMessage(WSMsgType.TEXT, json.dumps({"op": 11}), None)
+
+    shard._ws_session.receive = receive
+    with pytest.raises(ConnectionError):
+        await shard._perform_handshake()
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import socket
+
+import pytest
+from aiohttp import ClientTimeout, web
+from dispair.http.http_session import ApiPath, HttpSession, Priority
+from multidict import CIMultiDict
+
+
+class ResponseStub:
+    def __init__(self, status: int = 200, body: object = None, **headers):
+        self.status = status
+        self.content_type = "application/json"
+        self.headers = CIMultiDict({key.replace("_", "-"): str(value) for key, value in headers.items()})
+        self._body = json.dumps({} if body is None else body).encode()
+
+    async def read(self) -> bytes:
+        return self._body
+
+    def raise_for_status(self):
+        ...
+
+
+@pytest.fixture(scope="function")
+async def session() -> HttpSession:
+    session = HttpSession("token")
+    session.responses = []
+    session.in_flight = 0
+    session.max_in_flight = 0
+
+    async def request(method, url, **kwargs):
+        session.in_flight += 1
+        session.max_in_flight = max(session.max_in_flight, session.in_flight)
+        await asyncio.sleep(0.01)
+        session.in_flight -= 1
+        return session.responses.pop(0)
+
+    session._session.request = request
+    yield session
+    await session.kill()
+
+
+def bucket_headers(remaining: int, reset_after: float = 1) -> dict:
+    return {
+        "X_RateLimit_Bucket": "abc", "X_RateLimit_Limit": 5,
+        "X_RateLimit_Remaining": remaining, "X_RateLimit_Reset_After": reset_after,
+    }
+
+
+@pytest.mark.asyncio
+async def test_requests_concurrent_within_bucket(session: HttpSession):
+    path = ApiPath("/channels/{channel_id}/messages", channel_id=1)
+    session.responses = [ResponseStub(**bucket_headers(remaining)) for remaining in (4, 3, 2, 1, 0)]
+
+    # The first request learns the bucket, the rest can run at once.
+    await session.request("GET", path)
+    await asyncio.gather(*(session.request("GET", path) for _ in range(4)))
+    assert session.max_in_flight == 4
+
+    bucket = session.rate_limiter.get("GET", path)
+    assert bucket.limit == 5 and bucket.remaining == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_requests_retried(session: HttpSession):
+    path = ApiPath("/channels/{channel_id}/messages", channel_id=1)
+    session.responses = [
+        ResponseStub(429, {"retry_after": 0.05, "global": True}),
+        ResponseStub(429, {"retry_after": 0.05}, **bucket_headers(0, 0.05)),
+        ResponseStub(200, {"id": 1}, **bucket_headers(4)),
+    ]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    assert await session.request("GET", path) == {"id": 1}
+    assert loop.time() - started >= 0.1 and not session.responses
+
+
+@pytest.mark.asyncio
+async def test_idle_buckets_evicted(session: HttpSession):
+    limiter = session.rate_limiter
+    limiter.max_buckets = 3
+
+    # Routes without rate limits share one bucket, no state is kept per interaction.
+    for interaction_id in range(10):
+        session.responses.append(ResponseStub())
+        await session.request("POST", ApiPath(
+            "/interactions/{interaction_id}/{interaction_token}/callback",
+            interaction_id=interaction_id, interaction_token=f"token-{interaction_id}"
+        ))
+    assert len(limiter) <= 1
+
+    for token in range(10):
+        session.responses.append(ResponseStub(**bucket_headers(4, 0)))
+        await session.request("PATCH", ApiPath(
+            "/webhooks/{app_id}/{interaction_token}/messages/@original", app_id=1, interaction_token=token
+        ))
+    assert len(limiter) <= limiter.max_buckets
+
+    limiter.sweep()
+    assert len(limiter) == 0
+
+
+@pytest.mark.asyncio
+async def test_exhausted_bucket_does_not_block_caller(session: HttpSession):
+    path = ApiPath("/channels/{channel_id}/messages", channel_id=1)
+    session.responses = [ResponseStub(**bucket_headers(0, 0.1)), ResponseStub(**bucket_headers(4))]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await session.request("GET", path)
+    assert loop.time() - started < 0.1
+
+    bucket = session.rate_limiter.get("GET", path)
+    waiter = asyncio.create_task(session.request("GET", path))
+    await asyncio.sleep(0.02)
+    assert not waiter.done() and bucket._reset_handle is not None
+
+    await waiter
+    assert loop.time() - started >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_background_lane_does_not_delay_interactions(session: HttpSession):
+    session._lanes[Priority.BACKGROUND] = asyncio.Semaphore(1)
+    session.responses = [ResponseStub() for _ in range(6)]
+
+    background = [
+        asyncio.create_task(session.request(
+            "GET", ApiPath("/guilds/{guild_id}/commands", guild_id=guild), priority=Priority.BACKGROUND
+        ))
+        for guild in range(5)
+    ]
+    await asyncio.sleep(0)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await session.request(
+        "POST", ApiPath("/interactions/{interaction_id}/{interaction_token}/callback", interaction_id=1,
+                        interaction_token="abc"),
+        priority=Priority.INTERACTION
+    )
+    assert loop.time() - started < 0.03 and sum(task.done() for task in background) <= 1
+    await asyncio.gather(*background)
+
+
+@pytest.mark.asyncio
+async def test_lanes_fit_connection_pool():
+    sessions = [
+        HttpSession(connection_limit=10),
+        HttpSession(connection_limit_per_host=20),
+        HttpSession(connection_limit=0),
+        HttpSession(connection_limit=3),
+        HttpSession(connection_limit=2),
+        HttpSession(connection_limit_per_host=1),
+    ]
+    try:
+        assert [list(session.lane_limits.values()) for session in sessions] == [
+            [6, 3, 1], [12, 6, 2], [60, 30, 10], [1, 1, 1], [1, 1, 1], [1, 1, 1]
+        ]
+        # Lanes share the connections of a pool that is too small for one each.
+        assert [len({id(lane) for lane in session._lanes.values()}) for session in sessions] == [3, 3, 3, 3, 2, 1]
+        assert sessions[4]._lanes[Priority.INTERACTION] is not sessions[4]._lanes[Priority.DEFAULT]
+        with pytest.raises(ValueError):
+            HttpSession(connection_limit=10, lane_limits={Priority.BACKGROUND: 5})
+    finally:
+        for session in sessions:
+            await session.kill()
+
+
+@pytest.mark.asyncio
+async def test_websockets_do_not_take_pooled_connections():
+    async def websocket(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.receive()
+        return ws
+
+    async def get(request: web.Request) -> web.Response:
+        return web.json_response({})
+
+    app = web.Application()
+    app.add_routes((web.get("/ws", websocket), web.get("/get", get)))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    session = HttpSession(connection_limit=3)
+    try:
+        websockets = [await session.ws_connect(f"{url}/ws") for _ in range(3)]
+        # The pool is still free for requests while every websocket is open.
+        async with session._session.get(f"{url}/get", timeout=ClientTimeout(total=1)) as resp:
+            assert resp.status == 200
+        for ws in websockets:
+            await ws.close()
+    finally:
+        await session.kill()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_warm_opens_keepalive_connections():
+    peers = set()
+
+    async def gateway(request: web.Request) -> web.Response:
+        peers.add(request.transport.get_extra_info("peername"))
+        await asyncio.sleep(0.01)
+        return web.json_response({"url": ""})
+
+    app = web.Application()
+    app.add_routes((web.get("/gateway", gateway),))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    sock = socket.create_server(("127.0.0.1", 0))
+    await web.SockSite(runner, sock).start()
+
+    session = HttpSession(connection_limit=10, keepalive_timeout=30)
+    session.api_base = f"http://127.0.0.1:{sock.getsockname()[1]}/"
+    try:
+        await session.warm(3)
+        assert len(peers) == 3
+
+        # Requests reuse the warm connections.
+        await session.warm(3)
+        assert len(peers) == 3
+    finally:
+        await session.kill()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_global_rate_limit_does_not_mark_route_unlimited(session: HttpSession):
+    path = ApiPath("/channels/{channel_id}/messages", channel_id=1)
+    session.responses = [
+        ResponseStub(429, {"retry_after": 0.01, "global": True}),
+        ResponseStub(200, {"id": 1}, **bucket_headers(4)),
+    ]
+
+    assert await session.request("GET", path) == {"id": 1}
+    assert not session.rate_limiter._unlimited_routes
+    assert session.rate_limiter.get("GET", path).limit == 5
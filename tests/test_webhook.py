@@ -0,0 +1,250 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+from aiohttp import ClientSession, web
+from dispair import ASGIApplication, Router, WebhookClient
+from dispair.http import HttpSession
+from dispair.models import Interaction
+from nacl.signing import SigningKey
+
+SIGNING_KEY = SigningKey.generate()
+
+
+class RequestStub:
+    def __init__(self, body: bytes, timestamp: str = "1", signature: str = None):
+        self.reads = 0
+        self._body = body
+        if signature is None:
+            signature = SIGNING_KEY.sign(timestamp.encode() + body).signature.hex()
+        self.headers = {"X-Signature-Timestamp": timestamp, "X-Signature-Ed25519": signature}
+
+    async def read(self) -> bytes:
+        self.reads += 1
+        return self._body
+
+
+@pytest.fixture(scope="function", params=[0, 2])
+async def client(request) -> WebhookClient:
+    client = WebhookClient("", "1", SIGNING_KEY.verify_key.encode().hex(), verify_threads=request.param)
+    client._known_guilds.add(1)
+
+    router = Router()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        return "> test"
+
+    client.attach_router(router)
+    yield client
+    await client.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_webhook_interaction(client: WebhookClient):
+    body = json.dumps({
+        "id": "1", "application_id": "1", "type": 2, "token": "abc", "data": {"name": "test"},
+        "guild_id": "1", "channel_id": "1", "member": {"user": {"id": "2"}},
+    }).encode()
+    request = RequestStub(body)
+    response = await client._interaction(request)
+    assert response.status == 200 and request.reads == 1
+    assert json.loads(response.body)["data"]["content"] == "> test"
+
+    pong = await client._interaction(RequestStub(b'{"type": 1}'))
+    assert json.loads(pong.body) == {"type": 1}
+
+
+@pytest.mark.asyncio
+async def test_webhook_bad_signature(client: WebhookClient):
+    assert (await client._interaction(RequestStub(b'{"type": 1}', signature="00" * 64))).status == 401
+    assert (await client._interaction(RequestStub(b'{"type": 1}', signature="invalid"))).status == 401
+
+
+@pytest.mark.asyncio
+async def test_webhook_serves_prebound_socket(client: WebhookClient):
+    client._app.add_routes((web.post(client.interaction_endpoint, client._interaction),))
+    sock = socket.create_server(("127.0.0.1", 0))
+    server = asyncio.create_task(client._serve(sock))
+
+    body = b'{"type": 1}'
+    request = RequestStub(body)
+    url = f"http://127.0.0.1:{sock.getsockname()[1]}{client.interaction_endpoint}"
+    try:
+        async with ClientSession() as session:
+            for _ in range(50):
+                try:
+                    async with session.post(url, data=body, headers=request.headers) as resp:
+                        assert resp.status == 200 and await resp.json() == {"type": 1}
+                        break
+                except OSError:
+                    await asyncio.sleep(0.01)
+            else:
+                pytest.fail("Endpoint was never served")
+    finally:
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+        sock.close()
+
+
+@pytest.mark.asyncio
+async def test_asgi_application(client: WebhookClient):
+    app = ASGIApplication(client, sync_commands=False)
+    body = b'{"type": 1}'
+    request = RequestStub(body)
+
+    async def call(path: str, headers: dict) -> list[dict]:
+        messages = [{"type": "http.request", "body": body[:4], "more_body": True},
+                    {"type": "http.request", "body": body[4:]}]
+        sent = []
+
+        async def receive() -> dict:
+            return messages.pop(0)
+
+        async def send(message: dict):
+            sent.append(message)
+
+        scope = {
+            "type": "http", "method": "POST", "path": path,
+            "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()]
+        }
+        await app(scope, receive, send)
+        return sent
+
+    start, response = await call(client.interaction_endpoint, request.headers)
+    assert start["status"] == 200 and json.loads(response["body"]) == {"type": 1}
+
+    assert (await call(client.interaction_endpoint, {}))[0]["status"] == 401
+    assert (await call("/other", request.headers))[0]["status"] == 404
+
+
+def test_webhook_run_defers_on_client_loop():
+    loop = asyncio.new_event_loop()
+    with socket.create_server(("127.0.0.1", 0)) as sock:
+        port = sock.getsockname()[1]
+    client = WebhookClient("", "1", SIGNING_KEY.verify_key.encode().hex(), port=port, loop=loop, defer_after=0.01)
+    client._known_guilds.add(1)
+    patched = []
+
+    async def sync_commands():
+        pass
+
+    async def request(method: str, path: str, **kwargs):
+        # The follow-up must run on the loop the HttpSession belongs to.
+        assert asyncio.get_running_loop() is client._http_session.loop
+        patched.append((method, path.path, kwargs["json"]))
+        client.stop()
+
+    client.sync_commands = sync_commands
+    client._http_session.request = request
+
+    router = Router()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        await asyncio.sleep(0.05)
+        return "> test"
+
+    client.attach_router(router)
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        client.run()
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+
+    body = json.dumps({
+        "id": "1", "application_id": "1", "type": 2, "token": "abc", "data": {"name": "test"},
+        "guild_id": "1", "channel_id": "1", "member": {"user": {"id": "2"}},
+    }).encode()
+    headers = RequestStub(body).headers
+
+    async def post() -> dict:
+        async with ClientSession() as session:
+            for _ in range(100):
+                try:
+                    async with session.post(f"http://127.0.0.1:{port}/interactions", data=body, headers=headers) as resp:
+                        return await resp.json()
+                except OSError:
+                    await asyncio.sleep(0.01)
+            pytest.fail("Endpoint was never served")
+
+    assert asyncio.run(post()) == {"type": 5}
+    server.join(5)
+    assert not server.is_alive()
+    assert patched == [("PATCH", "/webhooks/1/abc/messages/@original", {
+        "content": "> test", "embeds": [], "allowed_mentions": {"parse": []}
+    })]
+    loop.close()
+
+
+def test_asgi_application_on_server_loop(monkeypatch):
+    requests = []
+
+    async def discord(request: web.Request) -> web.Response:
+        requests.append((request.method, request.path.lstrip("/")))
+        return web.json_response([])
+
+    client_loop = asyncio.new_event_loop()
+    client = WebhookClient("token", "1", SIGNING_KEY.verify_key.encode().hex(), loop=client_loop, defer_after=0.01)
+    router = Router()
+
+    @router.interaction("test", "Test command")
+    async def test_command(inter: Interaction):
+        await asyncio.sleep(0.05)
+        return "> test"
+
+    client.attach_router(router)
+    app = ASGIApplication(client)
+
+    async def serve():
+        server = web.Application()
+        server.add_routes((web.route("*", "/{tail:.*}", discord),))
+        runner = web.AppRunner(server)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        monkeypatch.setattr(HttpSession, "api_base", f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/")
+
+        lifespan = asyncio.Queue()
+        sent = []
+
+        async def send(message: dict):
+            sent.append(message)
+
+        lifespan_task = asyncio.create_task(app({"type": "lifespan"}, lifespan.get, send))
+        await lifespan.put({"type": "lifespan.startup"})
+        while not sent:
+            await asyncio.sleep(0.01)
+        assert sent.pop()["type"] == "lifespan.startup.complete"
+
+        body = json.dumps({
+            "id": "1", "application_id": "1", "type": 2, "token": "abc", "data": {"name": "test"},
+            "channel_id": "1", "user": {"id": "2"},
+        }).encode()
+        headers = RequestStub(body).headers
+        scope = {
+            "type": "http", "method": "POST", "path": client.interaction_endpoint,
+            "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()]
+        }
+
+        async def receive() -> dict:
+            return {"type": "http.request", "body": body}
+
+        await app(scope, receive, send)
+        assert json.loads(sent[-1]["body"]) == {"type": 5}
+
+        await lifespan.put({"type": "lifespan.shutdown"})
+        await lifespan_task
+        assert sent[-1]["type"] == "lifespan.shutdown.complete"
+        await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        client_loop.close()
+    assert ("GET", "applications/1/commands") in requests
+    assert ("PATCH", "webhooks/1/abc/messages/@original") in requests